@@ -7,11 +7,21 @@ from __future__ import (
     unicode_literals,
 )
 
+import inspect
+import itertools
 import logging
-from typing import Dict
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, Iterator, Tuple
 
-import requests
-from pdf2image import convert_from_bytes, convert_from_path
 from pdfminer.pdfparser import PDFSyntaxError
 from prettytable import PrettyTable
 
@@ -21,9 +31,13 @@ from disclosure_extractor.calculate import (
     estimate_investment_net_worth_JEF,
 )
 from disclosure_extractor.data_processing import process_document
+from disclosure_extractor.downloads import download_many, download_pdf
 from disclosure_extractor.image_processing import (
+    PAGE_SIZE,
     CheckboxesNotFound,
+    classify_page,
     extract_contours_from_page,
+    extract_document_structure,
 )
 from disclosure_extractor.jef.extraction import (
     extract_content,
@@ -37,7 +51,38 @@ from disclosure_extractor.judicial_watch_utils import (
     identify_sections,
     process_addendum,
 )
+from disclosure_extractor.ocr_cache import get_ocr_cache, set_ocr_cache
+from disclosure_extractor.page_cache import set_page_cache
+from disclosure_extractor.page_store import PageStore
+from disclosure_extractor.pages import (
+    PdfPages,
+    open_page_store,
+    render_pages,
+)
 from disclosure_extractor.post_processing import _fine_tune_results
+from disclosure_extractor.routing import detect_format
+
+
+def _render_settings(
+    dpi: int, resize: bool, render_to_size: bool, scale: float = 1.0
+) -> Dict:
+    """How to render pages for the scanned document pipelines
+
+    Pages are rendered as jpgs at `dpi` and, with `resize`, resized to the
+    page size the heuristics expect (scaled by `scale`).  With
+    `render_to_size` pdftoppm renders at that size directly instead, as a
+    raw image with no jpg round trip.
+
+    :param dpi: Resolution to render at
+    :param resize: Whether pages are brought to the expected page size
+    :param render_to_size: Whether to render at that size directly
+    :param scale: Size of the pages relative to the expected page size
+    :return: Keyword arguments for the render functions in `pages`
+    """
+    size = (round(PAGE_SIZE[0] * scale), round(PAGE_SIZE[1] * scale))
+    if render_to_size:
+        return {"dpi": dpi, "fmt": "ppm", "size": size}
+    return {"dpi": dpi, "fmt": "jpg", "resize": size if resize else None}
 
 
 def display_wealth(results: Dict[str, str]) -> None:
@@ -148,10 +193,10 @@ def process_financial_document(
         pdf_bytes = open(file_path, "rb").read()
     if url:
         logging.info("Downloading PDF from URL")
-        pdf_bytes = requests.get(url, stream=True).content
+        pdf_bytes = download_pdf(url)
 
     # Turn the PDF into an array of images
-    pages = convert_from_bytes(pdf_bytes)
+    pages = render_pages(pdf_bytes=pdf_bytes, dpi=200, fmt="ppm")
     page_total = len(pages)
     logging.info("Document is %s pages long" % page_total)
     logging.info("Determining document structure")
@@ -183,11 +228,31 @@ def process_financial_document(
 
 
 def process_judicial_watch(
-    file_path=None, url=None, pdf_bytes=None, show_logs=None
+    file_path=None,
+    url=None,
+    pdf_bytes=None,
+    show_logs=None,
+    page_store=None,
+    render_to_size=False,
+    skip_blank=False,
+    ocr_workers=1,
 ):
     """This is the second and more brute force method for ugly PDFs.
 
     This method relies upon our own slicing and dicing of the image.
+
+    If `page_store` is a directory, pages are decoded into a memory-mapped
+    `PageStore` under it, named after the PDF and render settings (or read
+    from it, if it already exists) instead of being kept as PIL images.
+
+    With `render_to_size` pdftoppm renders each page once at the size the
+    table heuristics expect, so no later stage has to resize it.
+
+    With `skip_blank` blank pages and pages without tables, such as cover
+    letters, are not searched for table cells.  What each page was taken
+    for is returned under "page_kinds".
+
+    With `ocr_workers` table cells are OCR'd in that many threads.
     """
     if show_logs:
         logging.getLogger().setLevel(logging.INFO)
@@ -205,10 +270,14 @@ def process_judicial_watch(
         pdf_bytes = open(file_path, "rb").read()
     if url:
         logging.info("Downloading PDF from URL")
-        pdf_bytes = requests.get(url, stream=True).content
+        pdf_bytes = download_pdf(url)
 
     # Turn the PDF into an array of images
-    pages = convert_from_bytes(pdf_bytes, thread_count=10, fmt="jpg", dpi=300)
+    render = _render_settings(300, False, render_to_size)
+    if page_store:
+        pages = open_page_store(page_store, pdf_bytes=pdf_bytes, **render)
+    else:
+        pages = render_pages(pdf_bytes=pdf_bytes, thread_count=10, **render)
     page_total = len(pages)
     logging.info("Document is %s pages long" % page_total)
 
@@ -219,15 +288,26 @@ def process_judicial_watch(
         addendum_page,
     ) = get_investment_pages(pages)
 
-    s1 = get_text_fields(non_investment_pages)
+    text_count = len(non_investment_pages)
+    page_kinds = text_kinds = investment_kinds = None
+    if skip_blank:
+        page_kinds = [classify_page(page) for page in pages]
+        text_kinds = page_kinds[:text_count]
+        investment_kinds = page_kinds[text_count:]
+
+    s1 = get_text_fields(non_investment_pages, text_kinds)
     document_data = identify_sections(s1)
-    results = extract_section_I_to_VI(document_data, non_investment_pages)
+    results = extract_section_I_to_VI(
+        document_data, non_investment_pages, ocr_workers
+    )
 
     logging.info("Processing Investments")
     # Process Section VII
     results = extract_section_VII(
-        results, investment_pages, len(non_investment_pages)
+        results, investment_pages, text_count, investment_kinds, ocr_workers
     )
+    if page_kinds:
+        results["page_kinds"] = page_kinds
 
     # Process Section VIII - Addendum
     addendum_data = process_addendum(addendum_page)
@@ -252,54 +332,136 @@ def extract_financial_document(
     pdf_bytes: bytes = None,
     show_logs: bool = False,
     resize: bool = False,
+    stream: bool = False,
+    structure_dpi: int = None,
+    page_store: str = None,
+    render_to_size: bool = False,
+    workers: int = 1,
+    clean_rows: bool = False,
+    skip_blank: bool = False,
+    batch_ocr: bool = False,
+    classify_codes: bool = False,
+    ocr_workers: int = 1,
+    confident_ocr: bool = False,
+    page_ocr: bool = False,
 ) -> Dict:
     """Extract documents with lowered memory footprint
 
+    With `stream` the PDF is never rasterized as a whole. Pages are rendered
+    one at a time for structure detection and again, page by page, while
+    their rows are OCR'd, so peak memory no longer grows with page count.
+
+    With `structure_dpi` the checkboxes and table cells are found on a cheap
+    render at that resolution, and only pages with cells to OCR are rendered
+    at full resolution.  This implies `stream`.  200 dpi finds the same
+    structure as a full render; much below that checkboxes start to drop out.
+
+    With `page_store` the pages are decoded once into a memory-mapped
+    `PageStore` under that directory, named after the PDF and render
+    settings, or read from it if it already exists, so several workers can
+    share them.
+
+    With `render_to_size` pdftoppm renders pages straight at the expected
+    page size, instead of at 300 dpi followed by a resize.  This implies
+    `resize`.
+
+    With `workers` the pages' contours are found in that many processes
+    while the document structure is determined.
+
+    With `clean_rows` table lines are removed a whole row at a time before
+    its cells are OCR'd, rather than one cell at a time.
+
+    With `skip_blank` blank pages and pages without tables, such as cover
+    letters, are not searched for the document structure.  What each page
+    was taken for is returned under "page_kinds".  Text lines on skipped
+    pages no longer add spurious, empty rows to the structure's sections;
+    rows that OCR as nothing are dropped from the results either way.
+
+    With `batch_ocr` the cells of each page are tiled together and OCR'd
+    with a few tesseract runs, instead of one or more runs per cell.
+
+    With `classify_codes` the letter codes of the investment table are read
+    by a glyph classifier, and only given to tesseract if it isn't sure.
+
+    With `ocr_workers` the rows of each page are OCR'd in that many threads.
+    The results are the same as OCRing them one at a time.
+
+    With `confident_ocr` codes and dates are OCR'd until tesseract is
+    confident of them, rather than with a fixed set of tesseract runs.  The
+    number of runs each took is returned with the cell as "ocr_attempts".
+
+    With `page_ocr` each page is OCR'd once as a whole, and its words are
+    assigned to the table cells they fall in.  Cells whose words are
+    missing or unclear are still OCR'd on their own.  The results have the
+    same form as those of OCRing every cell, so the two can be compared.
 
     :param file_path: Location of the PDF to extract
+    :param pdf_bytes: PDF as bytes
     :param show_logs: Should we show our logs
+    :param resize: Should we resize pages to the expected page size
+    :param stream: Should we render pages lazily instead of all at once
+    :param structure_dpi: Resolution to find the document structure at
+    :param page_store: Directory to keep page stores in
+    :param render_to_size: Should pages be rendered at the page size
+    :param workers: Number of processes to find the document structure with
+    :param clean_rows: Should table rows be cleaned in one pass
+    :param skip_blank: Should blank and plain text pages be skipped
+    :param batch_ocr: Should each page's cells be OCR'd in batches
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param ocr_workers: Number of threads to OCR rows with
+    :param confident_ocr: Should OCR stop at the first confident reading
+    :param page_ocr: Should each page be OCR'd once as a whole
     :return: Our results of the extracted content
     """
 
     if show_logs:
         logging.getLogger().setLevel(logging.INFO)
     logging.info("Starting pdf to image conversion")
-    if pdf_bytes:
-        xpages = convert_from_bytes(
-            pdf_bytes, thread_count=10, fmt="jpg", dpi=300
-        )
+    render = _render_settings(300, resize, render_to_size)
+    if page_store:
+        pages = open_page_store(page_store, file_path, pdf_bytes, **render)
+        logging.info("Document is %s pages long" % len(pages))
+    elif stream or structure_dpi:
+        pages = PdfPages(file_path=file_path, pdf_bytes=pdf_bytes, **render)
+        logging.info("Document is %s pages long" % len(pages))
     else:
-        xpages = convert_from_path(
-            file_path, thread_count=10, fmt="jpg", dpi=300
-        )
-
-    logging.info("Document is %s pages long" % len(xpages))
+        pages = render_pages(file_path, pdf_bytes, thread_count=10, **render)
+        logging.info("Document is %s pages long" % len(pages))
     logging.info("Determining document structure.")
 
-    pages = []
-    if resize:
-        for page in xpages:
-            pg = page.resize((1653, 2180))
-            pages.append(pg)
-
-    document_structure = extract_contours_from_page(pages, False)
+    structure_pages, scale = pages, 1.0
+    if structure_dpi:
+        scale = structure_dpi / 300
+        structure_pages = PdfPages(
+            file_path=file_path,
+            pdf_bytes=pdf_bytes,
+            **_render_settings(structure_dpi, resize, render_to_size, scale),
+        )
 
+    document_structure = extract_document_structure(
+        structure_pages, scale, workers=workers, skip_blank=skip_blank
+    )
     if document_structure["found_count"] < 8:
-        document_structure = extract_contours_from_page(pages, True)
-        # print(document_structure["found_count"])
-        if document_structure["found_count"] < 8:
-
-            logging.warning(
-                f"Failed to extract document structure {document_structure['found_count']}"
-            )
-            return {
-                "success": False,
-                "msg": "Failed to process document properly",
-                "checkbox_count_found": document_structure["found_count"],
-            }
+        logging.warning(
+            f"Failed to extract document structure {document_structure['found_count']}"
+        )
+        return {
+            "success": False,
+            "msg": "Failed to process document properly",
+            "checkbox_count_found": document_structure["found_count"],
+        }
 
     logging.info("Extracting content from financial disclosure")
-    results = process_document(document_structure, pages)
+    results = process_document(
+        document_structure,
+        pages,
+        clean_rows,
+        batch_ocr,
+        classify_codes,
+        ocr_workers,
+        confident_ocr,
+        page_ocr,
+    )
     results["page_count"] = len(pages)
     results["pdf_size"] = ""
     results["wealth"] = estimate_investment_net_worth(results)
@@ -347,3 +509,240 @@ def extract_vector_pdf(
         results = {"success": False, "msg": "PDFSyntaxError"}
 
     return results
+
+
+EXTRACTORS = {
+    "financial": process_financial_document,
+    "judicial_watch": process_judicial_watch,
+    "scanned": extract_financial_document,
+    "jef": process_jef_document,
+    "vector": extract_vector_pdf,
+}
+
+# Extractors that are built on pdfplumber and need a file on disk
+PATH_EXTRACTORS = ("jef", "vector")
+
+# Options a routed extractor needs, unless the caller says otherwise
+ROUTE_DEFAULTS = {"scanned": {"resize": True}}
+
+
+def _run_extractor(
+    extractor: str,
+    file_path: str = None,
+    url: str = None,
+    pdf_bytes: bytes = None,
+    **kwargs,
+) -> Dict:
+    """Run one of the EXTRACTORS on a path, URL or PDF bytes
+
+    With the "auto" extractor the format is detected first, the options
+    in ROUTE_DEFAULTS are filled in, keyword arguments the chosen
+    extractor does not take are dropped, and the route taken is recorded
+    in the results.
+
+    :param extractor: Name of the extractor to use, or "auto"
+    :param file_path: Location of the PDF
+    :param url: URL of the PDF
+    :param pdf_bytes: PDF as bytes
+    :param kwargs: Passed on to the extractor
+    :return: Extracted content
+    """
+    if url:
+        pdf_bytes = download_pdf(url)
+    if extractor == "auto":
+        route = detect_format(file_path, pdf_bytes)
+        logging.info(f"Routing document to the {route} extractor")
+        parameters = inspect.signature(EXTRACTORS[route]).parameters
+        kwargs = {**ROUTE_DEFAULTS.get(route, {}), **kwargs}
+        kwargs = {k: v for k, v in kwargs.items() if k in parameters}
+        results = _run_extractor(route, file_path, None, pdf_bytes, **kwargs)
+        if isinstance(results, dict):
+            results["route"] = route
+        return results
+    if extractor not in PATH_EXTRACTORS:
+        return EXTRACTORS[extractor](
+            file_path=file_path, pdf_bytes=pdf_bytes, **kwargs
+        )
+    if file_path:
+        return EXTRACTORS[extractor](file_path, **kwargs)
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as f:
+        f.write(pdf_bytes)
+        f.flush()
+        return EXTRACTORS[extractor](f.name, **kwargs)
+
+
+def extract_document(
+    file_path: str = None, url: str = None, pdf_bytes: bytes = None, **kwargs
+) -> Dict:
+    """Extract a financial disclosure of any format
+
+    A few cheap probes of the first page pick the extractor (see
+    `routing.detect_format`), and its name is stored in the results under
+    "route".
+
+    :param file_path: Location of the PDF
+    :param url: URL of the PDF
+    :param pdf_bytes: PDF as bytes
+    :param kwargs: Passed on to the extractor, where it takes them
+    :return: Extracted content
+    """
+    if not file_path and not url and not pdf_bytes:
+        logging.warning(
+            "\n\n--> No file, url or pdf_bytes submitted<--\n--> Exiting early\n"
+        )
+        return
+    return _run_extractor("auto", file_path, url, pdf_bytes, **kwargs)
+
+
+def _is_url(item) -> bool:
+    """Whether a batch input is a URL to download"""
+    return isinstance(item, str) and item.startswith(("http://", "https://"))
+
+
+def _prefetch_urls(inputs: Iterable, workers: int) -> Iterator[Tuple]:
+    """Pair each input with the document to extract, downloading URLs ahead
+
+    URLs are downloaded by `download_many` in background threads while the
+    documents before them are extracted, and replaced by the PDF bytes, or
+    by the exception their download failed with.
+
+    :param inputs: Documents to extract
+    :param workers: Number of downloads to run at once
+    :return: Generator of (input, document)
+    """
+    inputs, lookahead = itertools.tee(inputs)
+    downloads = download_many(
+        (item for item in lookahead if _is_url(item)), workers=workers
+    )
+    for item in inputs:
+        if _is_url(item):
+            _, document = next(downloads)
+            yield item, document
+        else:
+            yield item, item
+
+
+def _extract_one(item, extractor: str, kwargs: Dict) -> Dict:
+    """Extract a single document of a batch, reporting errors as results
+
+    :param item: File path (a string or path-like object), URL, PDF bytes
+    or a dict of keyword arguments
+    :param extractor: Name of the extractor to use if the item has none
+    :param kwargs: Keyword arguments for every extractor
+    :return: Extracted content
+    """
+    try:
+        if isinstance(item, dict):
+            item = dict(item)
+            extractor = item.pop("extractor", extractor)
+            kwargs = {**kwargs, **item}
+        elif isinstance(item, (bytes, bytearray)):
+            kwargs = {**kwargs, "pdf_bytes": bytes(item)}
+        elif _is_url(item):
+            kwargs = {**kwargs, "url": item}
+        else:
+            kwargs = {**kwargs, "file_path": os.fspath(item)}
+        return _run_extractor(extractor, **kwargs)
+    except Exception as e:
+        logging.warning(f"Failed to extract document: {e!r}")
+        return {"success": False, "msg": f"{type(e).__name__}: {e}"}
+
+
+def _extract_alone(item, extractor: str, kwargs: Dict) -> Dict:
+    """Extract a document in a worker process of its own
+
+    :param item: File path, URL, PDF bytes or a dict of keyword arguments
+    :param extractor: Name of the extractor to use if the item has none
+    :param kwargs: Keyword arguments for every extractor
+    :return: Extracted content
+    """
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        try:
+            return pool.submit(_extract_one, item, extractor, kwargs).result()
+        except BrokenProcessPool:
+            logging.warning(f"Worker process died extracting {item!r:.80}")
+            return {"success": False, "msg": "Worker process died"}
+
+
+def extract_many(
+    inputs: Iterable,
+    workers: int = 4,
+    ordered: bool = False,
+    extractor: str = "auto",
+    **kwargs,
+) -> Iterator[Tuple[Any, Dict]]:
+    """Extract a batch of documents in a pool of worker processes
+
+    Each input is a file path, a URL, PDF bytes, or a dict of keyword
+    arguments for the extractor that may name its own "extractor".  Only
+    a few documents per worker are queued at a time, so `inputs` can be a
+    long generator.  URLs are downloaded ahead by `download_many`, so
+    downloads overlap with extraction.  A document that fails to download
+    or extract, or whose worker dies, comes back as an unsuccessful result
+    instead of stopping the batch.  When a worker dies, the documents lost
+    with the pool are run again one at a time, so the others still
+    succeed.
+
+    :param inputs: Documents to extract
+    :param workers: Number of worker processes
+    :param ordered: Yield results in input order instead of as they finish
+    :param extractor: Name of the extractor in EXTRACTORS to use, or
+    "auto" to detect each document's format
+    :param kwargs: Passed on to the extractor for every document
+    :return: Generator of (input, results)
+    """
+    inputs = enumerate(_prefetch_urls(inputs, workers))
+    pending = OrderedDict()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            while len(pending) < workers * 2:
+                index, (item, document) = next(inputs, (None, (None, None)))
+                if index is None:
+                    break
+                if isinstance(document, Exception):
+                    future = Future()
+                    future.set_result(
+                        {
+                            "success": False,
+                            "msg": f"{type(document).__name__}: {document}",
+                        }
+                    )
+                else:
+                    future = pool.submit(
+                        _extract_one, document, extractor, kwargs
+                    )
+                pending[index] = (item, document, future)
+            if not pending:
+                return
+
+            if ordered:
+                index = next(iter(pending))
+            else:
+                futures = [future for _, _, future in pending.values()]
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                index = next(
+                    i for i, (_, _, f) in pending.items() if f in done
+                )
+            item, document, future = pending.pop(index)
+            try:
+                results = future.result()
+            except BrokenProcessPool:
+                # Every queued document was lost with the pool, and we can't
+                # tell which of them killed it, so run each in a process of
+                # its own and only the culprit fails.
+                pool.shutdown(wait=False)
+                results = _extract_alone(document, extractor, kwargs)
+                for i, (queued, queued_document, lost) in pending.items():
+                    if isinstance(lost.exception(), BrokenProcessPool):
+                        future = Future()
+                        future.set_result(
+                            _extract_alone(queued_document, extractor, kwargs)
+                        )
+                        pending[i] = (queued, queued_document, future)
+                pool = ProcessPoolExecutor(max_workers=workers)
+            yield item, results
+    finally:
+        for _, _, future in pending.values():
+            future.cancel()
+        pool.shutdown()
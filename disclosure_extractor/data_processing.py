@@ -1,15 +1,64 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import collections
 import logging
 import re
-from typing import Dict, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pytesseract
 from PIL import Image, ImageEnhance
 
-from disclosure_extractor.image_processing import clean_image
-from disclosure_extractor.image_processing import find_redactions
+from disclosure_extractor.glyphs import get_glyph_classifier
+from disclosure_extractor.image_processing import (
+    RedactionMap,
+    clean_cells,
+    clean_image,
+    crop_image,
+    find_redactions,
+    image_size,
+    prepare_page,
+    remove_page_lines,
+    to_gray,
+    to_pil,
+)
+from disclosure_extractor.ocr_cache import cell_hash, get_ocr_cache
+
+# Columns OCR'd as free text, rather than as a date or a code
+TEXT_COLUMNS = (1, 3, 6, 10)
+
+# White space around cells tiled together for OCR
+OCR_TILE_GAP = 40
+
+# Tallest canvas of tiled cells to OCR at once; tesseract's limit is 32767
+OCR_CANVAS_HEIGHT = 20000
+
+# Tesseract configurations tried in turn on code cells
+CODE_CONFIGS = ("--psm 6 --oem 3", "--psm 7 --oem 3", "--psm 10 --oem 3")
+
+# Readings with every word at least this confident are taken as they are
+MIN_OCR_CONFIDENCE = 80
+
+# Dates as they are written on the forms, e.g. 2011, 6/2011 or 6/15/11
+DATE_PATTERN = re.compile(
+    r"^((\d{1,2}[/.-]){1,2}\d{2}|(\d{1,2}[/.-]){0,2}(19|20)\d{2})$"
+)
+
+# Tesseract configuration for OCRing a whole page at once
+PAGE_OCR_CONFIG = "--psm 11 --oem 3"
+
+# Words with less of their box than this inside a cell may belong to the
+# cell next to it
+MIN_WORD_OVERLAP = 0.8
+
+# Configuration of the sharpened pass over date cells
+SHARP_DATE_CONFIG = (
+    "--psm 6 --oem 3 preserve_interword_spaces=1 -c "
+    "tessedit_char_whitelist=01234567890./: "
+)
 
 
 def ocr_page(image: Image) -> str:
@@ -41,12 +90,39 @@ def ocr_date(image: Image) -> str:
     return text
 
 
-def ocr_variables(slice: Image, column: int) -> str:
-    """OCR investment table sections Values range from A to H
+def ocr_confidence(image: Image, config: str) -> Tuple[str, float]:
+    """OCR an image along with how sure tesseract is of it
 
-    :param slice: Cropped table cell
-    :param column: Column to OCR
-    :return: return cell OCR value
+    :param image: Image to OCR
+    :param config: Tesseract configuration
+    :return: The text, a line per line found, and the confidence of its
+    least confident word, or 0 if there are no words
+    """
+    data = pytesseract.image_to_data(
+        image, config=config, output_type=pytesseract.Output.DICT
+    )
+    lines = collections.OrderedDict()
+    confidences = []
+    for block, paragraph, line, word, confidence in zip(
+        data["block_num"],
+        data["par_num"],
+        data["line_num"],
+        data["text"],
+        data["conf"],
+    ):
+        if not word.strip():
+            continue
+        lines.setdefault((block, paragraph, line), []).append(word)
+        confidences.append(float(confidence))
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, min(confidences, default=0.0)
+
+
+def code_possibilities(column: int) -> List[str]:
+    """Codes allowed in a column of the investment table
+
+    :param column: Column of the cell
+    :return: The possible codes
     """
     if column == 2 or column == 9:
         possibilities = ["A", "B", "C", "D", "E", "F", "G", "H1", "H2"]
@@ -65,26 +141,114 @@ def ocr_variables(slice: Image, column: int) -> str:
             "P3",
             "P4",
         ]
+    return possibilities
+
 
+def match_code(text: str, column: int) -> Optional[str]:
+    """Read OCR'd text as one of a column's codes
+
+    :param text: Text OCR'd from the cell
+    :param column: Column of the cell
+    :return: The code, or None if the text isn't one
+    """
+    possibilities = code_possibilities(column)
+    clean_text = text.replace("\n", "").strip().upper().strip(".")
+    if clean_text == "PL" or clean_text == "PI" or clean_text == "P|":
+        return "P1"
+    if len(clean_text) > 0:
+        if clean_text in possibilities:
+            if len(clean_text) > 0:
+                return clean_text
+    # Do some hacking around what weve seen in results
+    if column == 4 or column == 8:
+        if clean_text == "I":
+            return "J"
+    if clean_text == "WW" and "W" in possibilities:
+        return "W"
+    if clean_text.upper() == "CC" and "C" in possibilities:
+        return "C"
+    return None
+
+
+def ocr_code_cascade(
+    slice: Image, column: int, attempts: List[float] = None
+) -> str:
+    """OCR a code cell, trying no more configurations than needed
+
+    The configurations in `CODE_CONFIGS` are tried in turn until one reads
+    a code confidently.  Failing that, the most confident code read is
+    used.  Only if tesseract wasn't confident of anything it read is the
+    sharpened pass run.
+
+    :param slice: Cleaned table cell
+    :param column: Column of the cell
+    :param attempts: List to add the confidence of each tesseract run to
+    :return: The code, or • if there seems to be one we couldn't read
+    """
+    if attempts is None:
+        attempts = []
+    best, best_confidence = None, -1.0
+    read_confidently = False
+    for config in CODE_CONFIGS:
+        text, confidence = ocr_confidence(slice, config)
+        attempts.append(confidence)
+        code = match_code(text, column)
+        if code and confidence >= MIN_OCR_CONFIDENCE:
+            return code
+        if code and confidence > best_confidence:
+            best, best_confidence = code, confidence
+        read_confidently |= confidence >= MIN_OCR_CONFIDENCE
+    if best:
+        return best
+    if read_confidently:
+        # Tesseract is sure this isn't a code; sharpening won't change that
+        return "•"
+
+    enhanced_im = ImageEnhance.Sharpness(slice).enhance(2)
+    text, confidence = ocr_confidence(enhanced_im, "--psm 6 --oem 3")
+    attempts.append(confidence)
+    clean_text = text.replace("\n", "").strip().upper().strip(".")
+    if clean_text in code_possibilities(column):
+        return clean_text
+    return "•"
+
+
+def ocr_variables(
+    slice: Image,
+    column: int,
+    classify_codes: bool = False,
+    confident_ocr: bool = False,
+    attempts: List[float] = None,
+) -> str:
+    """OCR investment table sections Values range from A to H
+
+    With `classify_codes` the cell is first read by the glyph classifier,
+    and tesseract is only run if it isn't sure of the code.  With
+    `confident_ocr` tesseract's confidence decides how many times it is run
+    (see `ocr_code_cascade`).
+
+    :param slice: Cropped table cell
+    :param column: Column to OCR
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param confident_ocr: Should OCR stop at the first confident reading
+    :param attempts: List to add the confidence of each tesseract run to
+    :return: return cell OCR value
+    """
+    if classify_codes:
+        code = get_glyph_classifier().classify(
+            slice, code_possibilities(column)
+        )
+        if code:
+            return code
+    if confident_ocr:
+        return ocr_code_cascade(slice, column, attempts)
     for v in [6, 7, 10]:
         text = pytesseract.image_to_string(
             slice, config="--psm %s --oem 3" % v
         )
-        clean_text = text.replace("\n", "").strip().upper().strip(".")
-        if clean_text == "PL" or clean_text == "PI" or clean_text == "P|":
-            return "P1"
-        if len(clean_text) > 0:
-            if clean_text in possibilities:
-                if len(clean_text) > 0:
-                    return clean_text
-        # Do some hacking around what weve seen in results
-        if column == 4 or column == 8:
-            if clean_text == "I":
-                return "J"
-        if clean_text == "WW" and "W" in possibilities:
-            return "W"
-        if clean_text.upper() == "CC" and "C" in possibilities:
-            return "C"
+        code = match_code(text, column)
+        if code:
+            return code
     # If we can't identify a known possibility return • to indicate that
     # we think a value exists but we did not scrape it successfully.
     # print("Failed", clean_text)
@@ -95,11 +259,63 @@ def ocr_variables(slice: Image, column: int) -> str:
         enhanced_im, config="--psm 6 --oem 3"
     )
     clean_text = emhanced_attempt.replace("\n", "").strip().upper().strip(".")
-    if clean_text in possibilities:
+    if clean_text in code_possibilities(column):
         return clean_text
     return "•"
 
 
+def ocr_sharpened_date(image_crop: Image) -> str:
+    """OCR a date cell sharpened, straight from the page
+
+    :param image_crop: Cell cropped from the page
+    :return: The date
+    """
+    enhancer = ImageEnhance.Sharpness(to_pil(image_crop))
+    cleaned_sharpened = enhancer.enhance(2)
+    cell_text = pytesseract.image_to_string(
+        cleaned_sharpened, config=SHARP_DATE_CONFIG
+    ).strip()
+    if "." in cell_text:
+        cell_text = cell_text.split(".")[-1]
+    return cell_text
+
+
+def ocr_date_cascade(
+    image_crop: Image,
+    cleaned: Image,
+    column: int,
+    attempts: List[float] = None,
+) -> str:
+    """OCR a date cell, only sharpening it if the first reading is unsure
+
+    :param image_crop: Cell cropped from the page
+    :param cleaned: The cell cleaned for OCR
+    :param column: Column of the cell
+    :param attempts: List to add the confidence of each tesseract run to,
+    or None for the sharpened pass
+    :return: The date
+    """
+    if attempts is None:
+        attempts = []
+    if column == 7:
+        config = (
+            "-c tessedit_char_whitelist=01234567890./: "
+            "preserve_interword_spaces=1x1 --psm 11 --oem 3"
+        )
+    else:
+        config = "-c preserve_interword_spaces=1x1 --psm 6 --oem 3"
+    text, confidence = ocr_confidence(cleaned, config)
+    attempts.append(confidence)
+    text = re.sub(" +", " ", text.replace("\n", " ").strip())
+    if "." in text:
+        text = text.split(".")[-1]
+    if confidence >= MIN_OCR_CONFIDENCE and DATE_PATTERN.match(text):
+        return text
+
+    attempts.append(None)
+    return ocr_sharpened_date(image_crop)
+
+
 def check_if_blank(cell_image: Image) -> bool:
     """Check if image is blank
 
@@ -122,14 +338,49 @@ def check_if_blank(cell_image: Image) -> bool:
     return False
 
 
-def ocr_slice(image_crop: Image, column_index: int, field=None) -> str:
+def prepare_cell(image_crop: Image, cleaned=None) -> Optional[Image.Image]:
+    """Clean a cell for OCR
+
+    :param image_crop: Cell cropped from the page
+    :param cleaned: The cell already cleaned, e.g. by `clean_cells`
+    :return: The cleaned cell, or None if it is blank
+    """
+    if cleaned is None:
+        cleaned = clean_image(image_crop)
+    if cleaned.size == 0:
+        return None
+
+    cleaned_image_for_ocr = Image.fromarray(cleaned)
+    if check_if_blank(cleaned_image_for_ocr):
+        return None
+    return cleaned_image_for_ocr
+
+
+def ocr_slice(
+    image_crop: Image,
+    column_index: int,
+    field=None,
+    cleaned=None,
+    classify_codes: bool = False,
+    confident_ocr: bool = False,
+    attempts: List[float] = None,
+) -> str:
     """OCR cell based on column index
 
     Determine which function to use to OCR paticular column sections of
-    the financial disclosure.
+    the financial disclosure.  If an OCR cache is set up (see
+    `disclosure_extractor.ocr_cache.set_ocr_cache`) cells that look the
+    same as one already OCR'd the same way are given its text.
+
+    With `confident_ocr` codes and dates are OCR'd by `ocr_code_cascade`
+    and `ocr_date_cascade`, which stop at the first confident reading.
 
     :param image_crop: Image to OCR
     :param column_index: Column we are processing
+    :param cleaned: The cell already cleaned, e.g. by `clean_cells`
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param confident_ocr: Should OCR stop at the first confident reading
+    :param attempts: List to add the confidence of each tesseract run to
     :return: text of cell.
     """
     if field == "Addendum":
@@ -146,35 +397,40 @@ def ocr_slice(image_crop: Image, column_index: int, field=None) -> str:
             return found_parts[-1].strip("\n")
         return addendum_raw
 
-    cleaned_image = clean_image(image_crop)
-    if cleaned_image.size == 0:
+    cleaned_image_for_ocr = prepare_cell(image_crop, cleaned)
+    if cleaned_image_for_ocr is None:
         return ""
+    cache = get_ocr_cache()
+    if cache:
+        key = cache.key(
+            cell_hash(cleaned_image_for_ocr),
+            (column_index, field, classify_codes, confident_ocr),
+        )
+        cell_text = cache.get(key)
+        if cell_text is not None:
+            return cell_text
 
-    cleaned_image_for_ocr = Image.fromarray(cleaned_image)
-    if check_if_blank(cleaned_image_for_ocr):
-        return ""
-    if (
-        column_index == 1
-        or column_index == 6
-        or column_index == 10
-        or column_index == 3
-    ):
+    if confident_ocr and field in ("Date", "D2"):
+        cell_text = ocr_date_cascade(
+            image_crop, cleaned_image_for_ocr, column_index, attempts
+        )
+    elif column_index in TEXT_COLUMNS:
         cell_text = ocr_page(cleaned_image_for_ocr)
     elif column_index == 7:
         cell_text = ocr_date(cleaned_image_for_ocr)
     else:
-        cell_text = ocr_variables(cleaned_image_for_ocr, column_index)
-
-    if field == "Date" or field == "D2":
-        enhancer = ImageEnhance.Sharpness(image_crop)
-        cleaned_sharpened = enhancer.enhance(2)
-        cell_text = pytesseract.image_to_string(
-            cleaned_sharpened,
-            config="--psm 6 --oem 3 preserve_interword_spaces=1 -c "
-            "tessedit_char_whitelist=01234567890./: ",
-        ).strip()
-        if "." in cell_text:
-            cell_text = cell_text.split(".")[-1]
+        cell_text = ocr_variables(
+            cleaned_image_for_ocr,
+            column_index,
+            classify_codes,
+            confident_ocr,
+            attempts,
+        )
+
+    if not confident_ocr and (field == "Date" or field == "D2"):
+        cell_text = ocr_sharpened_date(image_crop)
+    if cache:
+        cache.put(key, cell_text)
     return cell_text
 
 
@@ -183,17 +439,18 @@ def add_first_four(results, page):
     four = ["reporting_period", "date_of_report", "court", "judge"]
     for one in results["first_four"]:
         if i > 0:
-            slice = page.crop(
+            slice = crop_image(
+                page,
                 (
                     one[0],
                     one[1] * 1.2,
                     one[0] + one[2],
                     one[1] * 1.2 + one[3] * 0.7,
-                )
+                ),
             )
         else:
-            slice = page.crop(
-                (one[0], one[1], one[0] + one[2], one[1] + one[3])
+            slice = crop_image(
+                page, (one[0], one[1], one[0] + one[2], one[1] + one[3])
             )
         results[four[i]] = ocr_slice(slice, 1, None).replace("\n", " ").strip()
         i += 1
@@ -222,8 +479,8 @@ def process_addendum_normal(
     :param results: Extracted data
     :return: Extract data with addendum content
     """
-    w, h = images[-2].size
-    cropped_addendum_page = images[-2].crop((0, h * 0.1, w, h * 0.95))
+    w, h = image_size(images[-2])
+    cropped_addendum_page = crop_image(images[-2], (0, h * 0.1, w, h * 0.95))
     results["Additional Information or Explanations"] = {
         "is_redacted": find_redactions(cropped_addendum_page),
         "text": ocr_slice(cropped_addendum_page, 1, "Addendum"),
@@ -231,41 +488,425 @@ def process_addendum_normal(
     return results
 
 
+def map_threads(function: Callable, items: List, workers: int = 1) -> List:
+    """Call a function on each item, in a pool of threads if asked
+
+    tesseract runs in its own process and OpenCV releases the GIL, so
+    threads are enough to OCR several cells at once.  Results come back in
+    the order of `items` however the calls finish.
+
+    :param function: Function to call on each item
+    :param items: Items to call it on
+    :param workers: Number of threads to use; one runs the calls in turn
+    :return: What the function returned for each item
+    """
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, items))
+
+
+def ocr_columns(row: Dict) -> Dict[str, int]:
+    """The column each cell of a row is OCR'd as
+
+    :param row: Row of page location data
+    :return: Column index for each field
+    """
+    columns = {}
+    ocr_key = 1
+    for field, column in row.items():
+        if column["section"] == "Liabilities":
+            ocr_key += 1
+            columns[field] = ocr_key if ocr_key == 4 else 1
+        elif column["section"] == "Investments and Trusts":
+            columns[field] = ocr_key
+            ocr_key += 1
+        else:
+            columns[field] = ocr_key
+    return columns
+
+
+def tile_cells(
+    cells: List[np.ndarray], gap: int = OCR_TILE_GAP
+) -> Tuple[np.ndarray, List[int]]:
+    """Stack cells down a white canvas, `gap` pixels apart
+
+    :param cells: Grayscale cells
+    :param gap: White space above, below and between cells
+    :return: The canvas and the top of each cell on it
+    """
+    width = max(cell.shape[1] for cell in cells) + 2 * gap
+    height = sum(cell.shape[0] for cell in cells) + gap * (len(cells) + 1)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    tops = []
+    y = gap
+    for cell in cells:
+        h, w = cell.shape
+        canvas[y : y + h, gap : gap + w] = cell
+        tops.append(y)
+        y += h + gap
+    return canvas, tops
+
+
+def words_by_tile(
+    data: Dict[str, List], tops: List[int], gap: int
+) -> List[str]:
+    """Put the words tesseract found on a canvas back into their cells
+
+    Each word goes to the cell its middle is closest to, and the words of
+    a cell are joined in the order tesseract read them.
+
+    :param data: `pytesseract.image_to_data` output as a dict
+    :param tops: Top of each cell on the canvas, from `tile_cells`
+    :param gap: Space between the cells
+    :return: Text of each cell
+    """
+    bounds = [top - gap // 2 for top in tops]
+    words = [[] for _ in tops]
+    for text, top, height in zip(data["text"], data["top"], data["height"]):
+        text = str(text).strip()
+        if not text:
+            continue
+        tile = bisect.bisect_right(bounds, int(top) + int(height) / 2) - 1
+        words[max(tile, 0)].append(text)
+    return [" ".join(tile_words) for tile_words in words]
+
+
+def ocr_cells(
+    cells: List[Image.Image], config: str, gap: int = OCR_TILE_GAP
+) -> List[str]:
+    """OCR many cells with as few tesseract runs as possible
+
+    The cells are tiled onto canvases of up to `OCR_CANVAS_HEIGHT` pixels,
+    each read by a single tesseract process, and the words found are
+    mapped back to their cells by position.
+
+    :param cells: Cleaned cells
+    :param config: Tesseract configuration
+    :param gap: Space between the cells
+    :return: Text of each cell
+    """
+    arrays = [to_gray(np.asarray(cell)) for cell in cells]
+    texts = []
+    start = 0
+    while start < len(arrays):
+        end, height = start, gap
+        while end < len(arrays) and (
+            end == start
+            or height + arrays[end].shape[0] + gap <= OCR_CANVAS_HEIGHT
+        ):
+            height += arrays[end].shape[0] + gap
+            end += 1
+        canvas, tops = tile_cells(arrays[start:end], gap)
+        data = pytesseract.image_to_data(
+            Image.fromarray(canvas),
+            config=config,
+            output_type=pytesseract.Output.DICT,
+        )
+        texts.extend(words_by_tile(data, tops, gap))
+        start = end
+    return texts
+
+
+def batch_ocr_rows(
+    rows: List[Dict],
+    page: Image.Image,
+    clean_rows: bool = False,
+    classify_codes: bool = False,
+    confident_ocr: bool = False,
+) -> List[Optional[Dict[str, str]]]:
+    """OCR the cells of many rows of a page together
+
+    Free text cells are read with one tesseract run for all of them, and
+    so are code cells, instead of one or more runs per cell.  A code cell
+    whose text isn't one of its column's codes, and every date, is still
+    OCR'd on its own by `ocr_slice`.  Cells found in the OCR cache are not
+    OCR'd again.
+
+    :param rows: Rows of page location data, all on `page`
+    :param page: The Page to OCR from
+    :param clean_rows: Should each row be cleaned in one pass
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param confident_ocr: Should codes OCR'd on their own stop at the first
+    confident reading
+    :return: For each row, text of the cells that were OCR'd, or None if
+    the row could not be prepared
+    """
+    cache = get_ocr_cache()
+    texts = []
+    text_cells, code_cells = [], []
+    for row in rows:
+        columns = ocr_columns(row)
+        try:
+            if clean_rows:
+                coords = [column["coords"] for column in row.values()]
+                cleaned = clean_cells(page, coords)
+            else:
+                cleaned = [None] * len(row)
+            cells = {}
+            for (field, column), cell in zip(row.items(), cleaned):
+                if field in ("Date", "D2") or columns[field] == 7:
+                    continue
+                crop = crop_image(page, column["coords"])
+                cells[field] = prepare_cell(crop, cell)
+        except Exception:
+            texts.append(None)
+            continue
+
+        row_texts = {}
+        for field, cell in cells.items():
+            if cell is None:
+                row_texts[field] = ""
+                continue
+            column = columns[field]
+            key = None
+            if cache:
+                key = cache.key(
+                    cell_hash(cell),
+                    ("batch", column, classify_codes, confident_ocr),
+                )
+                text = cache.get(key)
+                if text is not None:
+                    row_texts[field] = text
+                    continue
+            if column in TEXT_COLUMNS:
+                text_cells.append((row_texts, field, cell, key))
+                continue
+            code = None
+            if classify_codes:
+                code = get_glyph_classifier().classify(
+                    cell, code_possibilities(column)
+                )
+            if code:
+                row_texts[field] = code
+                if cache:
+                    cache.put(key, code)
+            else:
+                code_cells.append((row_texts, field, cell, column, key))
+        texts.append(row_texts)
+
+    if text_cells:
+        found = ocr_cells(
+            [cell for _, _, cell, _ in text_cells],
+            "-c preserve_interword_spaces=1x1 --psm 6 --oem 3",
+        )
+        for (row_texts, field, _, key), text in zip(text_cells, found):
+            row_texts[field] = re.sub(" +", " ", text.replace("|", ""))
+            if cache:
+                cache.put(key, row_texts[field])
+    if code_cells:
+        found = ocr_cells(
+            [cell for _, _, cell, _, _ in code_cells], "--psm 6 --oem 3"
+        )
+        for (row_texts, field, cell, column, key), text in zip(
+            code_cells, found
+        ):
+            code = match_code(text, column)
+            if code is None:
+                code = ocr_variables(cell, column, confident_ocr=confident_ocr)
+            row_texts[field] = code
+            if cache:
+                cache.put(key, code)
+    return texts
+
+
+class WordIndex:
+    """Words OCR'd from a whole page, for looking up by cell
+
+    Words are kept sorted by the y of their centers, so finding the words
+    of a cell is a bisect to those centered between its top and bottom and
+    a check of their x, like `RedactionMap`.
+    """
+
+    def __init__(self, data: Dict[str, List]):
+        words = [
+            i
+            for i, text in enumerate(data["text"])
+            if text.strip() and float(data["conf"][i]) >= 0
+        ]
+        boxes = np.array(
+            [
+                [data[key][i] for key in ("left", "top", "width", "height")]
+                for i in words
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 4)
+        centers = boxes[:, 1] + boxes[:, 3] / 2
+        order = np.argsort(centers, kind="stable")
+        self.boxes = boxes[order]
+        self.centers = centers[order]
+        self.confidences = np.array(
+            [float(data["conf"][i]) for i in words], dtype=np.float64
+        )[order]
+        self.texts = [data["text"][words[i]].strip() for i in order]
+
+    def text_of(self, box: Tuple) -> Optional[str]:
+        """Text of the words centered in a cell
+
+        :param box: Cell as (left, top, right, bottom), as for cropping
+        :return: The text, a line per line of words, "" if there are no
+        words, or None if tesseract wasn't sure of them or they spill over
+        into other cells
+        """
+        x0, y0, x1, y1 = box
+        start = np.searchsorted(self.centers, y0, side="left")
+        end = np.searchsorted(self.centers, y1, side="right")
+        x, y, w, h = self.boxes[start:end].T
+        inside = np.flatnonzero((x + w / 2 >= x0) & (x + w / 2 <= x1))
+        if not len(inside):
+            return ""
+        x, y, w, h = x[inside], y[inside], w[inside], h[inside]
+        overlap = (np.minimum(x + w, x1) - np.maximum(x, x0)).clip(0) * (
+            np.minimum(y + h, y1) - np.maximum(y, y0)
+        ).clip(0)
+        confidences = self.confidences[start:end][inside]
+        if (overlap < MIN_WORD_OVERLAP * w * h).any() or (
+            confidences < MIN_OCR_CONFIDENCE
+        ).any():
+            return None
+
+        # Words whose middle is above the bottom of the last line are on it
+        lines = []
+        for i in np.argsort(y, kind="stable"):
+            if lines and y[i] + h[i] / 2 <= lines[-1][0]:
+                lines[-1][0] = max(lines[-1][0], y[i] + h[i])
+                lines[-1][1].append(i)
+            else:
+                lines.append([y[i] + h[i], [i]])
+        return "\n".join(
+            " ".join(
+                self.texts[start + inside[i]]
+                for i in sorted(line, key=lambda i: x[i])
+            )
+            for _, line in lines
+        )
+
+
+def ocr_page_words(page: Image.Image) -> Dict[str, List]:
+    """OCR a whole page at once, keeping the box of every word
+
+    :param page: The Page to OCR
+    :return: `pytesseract.image_to_data` results
+    """
+    return pytesseract.image_to_data(
+        Image.fromarray(remove_page_lines(page)),
+        config=PAGE_OCR_CONFIG,
+        output_type=pytesseract.Output.DICT,
+    )
+
+
+def page_ocr_rows(
+    rows: List[Dict], page: Image.Image
+) -> List[Optional[Dict[str, str]]]:
+    """Read the cells of many rows of a page from one OCR of the page
+
+    Each word found is given to the cell its center falls in.  Cells with
+    words tesseract wasn't sure of, words that spill over into the next
+    cell, no words in spite of ink, or a code or date that doesn't read as
+    one, are left out to be OCR'd on their own.
+
+    :param rows: Rows of page location data, all on `page`
+    :param page: The Page to OCR from
+    :return: For each row, text of the cells that were read
+    """
+    index = WordIndex(ocr_page_words(page))
+    texts = []
+    read = total = 0
+    for row in rows:
+        columns = ocr_columns(row)
+        row_texts = {}
+        for field, column in row.items():
+            total += 1
+            text = index.text_of(column["coords"])
+            if text is None:
+                continue
+            if not text:
+                try:
+                    blank = prepare_cell(crop_image(page, column["coords"]))
+                except Exception:
+                    continue
+                if blank is None:
+                    row_texts[field] = ""
+            elif field in ("Date", "D2") or columns[field] == 7:
+                text = text.replace("\n", " ").strip().split(".")[-1]
+                if DATE_PATTERN.match(text):
+                    row_texts[field] = text
+            elif columns[field] in TEXT_COLUMNS:
+                text = text.replace("\n", " ").strip().replace("|", "")
+                row_texts[field] = re.sub(" +", " ", text)
+            else:
+                code = match_code(text, columns[field])
+                if code:
+                    row_texts[field] = code
+        read += len(row_texts)
+        texts.append(row_texts)
+    logging.info(f"Read {read} of {total} cells from the page's OCR")
+    return texts
+
+
 def process_row(
     row: Dict,
     page: Image.Image,
     results: Dict,
     section_title: str,
     row_count: int,
+    redactions: RedactionMap = None,
+    clean_rows: bool = False,
+    texts: Dict[str, str] = None,
+    classify_codes: bool = False,
+    confident_ocr: bool = False,
 ) -> Dict:
-    """Process individual rows in a section with threading
+    """Process individual rows in a section
+
+    Each cell of the row is written back to its existing place in
+    `results`, so rows can be processed in any order, or at the same time.
+
+    With `clean_rows` the table lines are removed from the row as a whole
+    by `clean_cells`, instead of from each cell on its own.
+
+    With `confident_ocr` codes and dates are OCR'd until tesseract is
+    confident of them, and cells that were get the number of tesseract runs
+    it took as "ocr_attempts", and the confidence of each as
+    "ocr_confidences".
 
     :param row: Row of page location data
     :param page: The Page to OCR from
     :param results: The current data extracted
     :param section_title: The section the row belongs to
     :param row_count: Row count
+    :param redactions: Redaction boxes on the page, if already found
+    :param clean_rows: Should the row be cleaned in one pass
+    :param texts: Text of cells already OCR'd, by `batch_ocr_rows`
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param confident_ocr: Should OCR stop at the first confident reading
     :return: Results with data added
     """
-    ocr_key = 1
     page_number = None
     sect = None
+    texts = texts or {}
+    columns = ocr_columns(row)
+    cleaned = {}
+    if clean_rows and len(texts) < len(row):
+        coords = [column["coords"] for column in row.values()]
+        cleaned = dict(zip(row.keys(), clean_cells(page, coords)))
     for field, column in row.items():
         if not page_number:
             page_number = int(column["page"]) + 1
             sect = column["section"]
-        crop = page.crop(column["coords"])
-        if column["section"] == "Liabilities":
-            ocr_key += 1
-            if ocr_key == 4:
-                text = ocr_slice(crop, ocr_key, field).strip()
-            else:
-                text = ocr_slice(crop, 1, field).strip()
-        elif column["section"] == "Investments and Trusts":
-            text = ocr_slice(crop, ocr_key, field).strip()
-            ocr_key += 1
+        crop = crop_image(page, column["coords"])
+        attempts = []
+        if field in texts:
+            text = texts[field].strip()
         else:
-            text = ocr_slice(crop, ocr_key, field).strip()
+            text = ocr_slice(
+                crop,
+                columns[field],
+                field,
+                cleaned.get(field),
+                classify_codes,
+                confident_ocr,
+                attempts,
+            ).strip()
 
         data = {}
         if column["section"] == "Investments and Trusts":
@@ -273,8 +914,14 @@ def process_row(
         else:
             data["text"] = text
 
-        data["is_redacted"] = find_redactions(crop)
+        if redactions:
+            data["is_redacted"] = redactions.is_redacted(column["coords"])
+        else:
+            data["is_redacted"] = find_redactions(crop)
         data["page_number"] = page_number
+        if attempts:
+            data["ocr_attempts"] = len(attempts)
+            data["ocr_confidences"] = attempts
 
         results["sections"][section_title]["rows"][row_count][field] = data
 
@@ -285,23 +932,109 @@ def process_row(
 def process_document(
     results: Dict[str, Union[str, int, float, List, Dict]],
     pages: List,
+    clean_rows: bool = False,
+    batch_ocr: bool = False,
+    classify_codes: bool = False,
+    ocr_workers: int = 1,
+    confident_ocr: bool = False,
+    page_ocr: bool = False,
 ) -> Dict[str, Union[str, int, float, List, Dict]]:
     """Iterate over parsed document location data
 
+    Rows are visited page by page, so when `pages` renders lazily (see
+    `disclosure_extractor.pages.PdfPages`) each page is only needed while
+    its own rows are being OCR'd.  Cells are checked for redactions against
+    the boxes found while detecting the structure, when it kept them.
+
+    With `batch_ocr` the cells of a page are OCR'd together by
+    `batch_ocr_rows`, or one at a time if that fails.  With `classify_codes` investment codes are read by
+    `disclosure_extractor.glyphs.GlyphClassifier` where it is sure of them.
+
+    With `ocr_workers` the rows of a page are processed in that many
+    threads.  Every row fills in cells that are already in `results`, so
+    the output is the same whatever order they finish in.
+
+    With `confident_ocr` codes and dates are OCR'd until tesseract is
+    confident of them, rather than with a fixed set of tesseract runs.
+
+    With `page_ocr` each page is OCR'd once and its words are given to the
+    cells they fall in by `page_ocr_rows`; only cells it can't read, or
+    every cell if the page's OCR fails, are OCR'd on their own.  This takes
+    the place of `batch_ocr`.
+
     :param results: Collected data
     :param pages: page images
-    :param resize: Whether to resize teh image
+    :param clean_rows: Should each row be cleaned in one pass
+    :param batch_ocr: Should each page's cells be OCR'd in batches
+    :param classify_codes: Should codes be read without tesseract if we can
+    :param ocr_workers: Number of threads to OCR rows with
+    :param confident_ocr: Should OCR stop at the first confident reading
+    :param page_ocr: Should each page be OCR'd once as a whole
     :return: OCR'd data
     """
+    redactions = results.pop("redactions", {})
+    rows = []
     for k, v in results["sections"].items():
         for row_count, row in v["rows"].items():
             try:
-                page = pages[row[v["fields"][0]].get("page")]
-                results = process_row(row, page, results, k, row_count)
+                page_number = row[v["fields"][0]].get("page")
             except Exception as e:
                 # Field doesnt exist for row
+                continue
+            if page_number is not None:
+                rows.append((page_number, k, row_count, row))
+
+    rows.sort(key=lambda x: x[0])
+    for page_number, page_rows in groupby(rows, key=lambda x: x[0]):
+        try:
+            # Convert each page once; its cells are cropped as views of it
+            page = prepare_page(pages[page_number])
+        except Exception as e:
+            continue
+        redaction_map = None
+        if page_number in redactions:
+            redaction_map = RedactionMap(redactions[page_number])
+        page_rows = list(page_rows)
+        texts = [None] * len(page_rows)
+        if page_ocr:
+            try:
+                texts = page_ocr_rows([x[3] for x in page_rows], page)
+            except Exception as e:
+                # Leave the page's cells to be OCR'd one at a time
+                logging.warning(f"Page OCR of pg {page_number} failed: {e!r}")
+        elif batch_ocr:
+            try:
+                texts = batch_ocr_rows(
+                    [x[3] for x in page_rows],
+                    page,
+                    clean_rows,
+                    classify_codes,
+                    confident_ocr,
+                )
+            except Exception as e:
+                # Leave the page's cells to be OCR'd one at a time
+                logging.warning(f"Batch OCR of pg {page_number} failed: {e!r}")
+
+        def ocr_row(task):
+            (_, k, row_count, row), row_texts = task
+            try:
+                process_row(
+                    row,
+                    page,
+                    results,
+                    k,
+                    row_count,
+                    redaction_map,
+                    clean_rows,
+                    row_texts,
+                    classify_codes,
+                    confident_ocr,
+                )
+            except Exception as e:
                 pass
 
+        map_threads(ocr_row, list(zip(page_rows, texts)), ocr_workers)
+
     # Process addendum
     results = process_addendum_normal(pages, results)
 
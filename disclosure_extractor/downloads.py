@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Largest PDF we are willing to download, in bytes
+MAX_PDF_SIZE = 50 * 1024**2
+
+_session = None
+_session_pid = None
+
+
+class DownloadError(Exception):
+    """Base class for download exceptions"""
+
+    pass
+
+
+class PDFTooLarge(DownloadError):
+    """Raised when a download is larger than the allowed size"""
+
+    pass
+
+
+def get_session(pool_size: int = 16) -> requests.Session:
+    """Connection pooled session shared by all downloads in this process
+
+    :param pool_size: Number of connections to keep open per host
+    :return: The session
+    """
+    global _session, _session_pid
+    # Sessions must not be shared with forked worker processes
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session_pid = os.getpid()
+    return _session
+
+
+def download_pdf(
+    url: str,
+    max_size: int = MAX_PDF_SIZE,
+    timeout: Union[float, Tuple[float, float]] = (10, 60),
+    retries: int = 3,
+    backoff: float = 1.0,
+) -> bytes:
+    """Download a PDF through the shared session
+
+    The body is streamed in chunks and the download is abandoned as soon
+    as it grows past `max_size`.  Connection errors,
+    timeouts and server errors are retried with exponential backoff.
+
+    :param url: URL of the PDF
+    :param max_size: Largest download allowed, in bytes
+    :param timeout: Connect and read timeouts in seconds
+    :param retries: Number of times to retry a failed download
+    :param backoff: Seconds to wait before the first retry, doubled after
+    :return: The PDF as bytes
+    """
+    attempt = 0
+    while True:
+        try:
+            return _download(url, max_size, timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code < 500:
+                raise
+            error = e
+        if attempt >= retries:
+            raise error
+        delay = backoff * 2**attempt
+        logging.warning(f"Retrying {url} in {delay}s after {error}")
+        time.sleep(delay)
+        attempt += 1
+
+
+def _download(
+    url: str, max_size: int, timeout: Union[float, Tuple[float, float]]
+) -> bytes:
+    with get_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_size:
+            raise PDFTooLarge(f"{url} is {length} bytes")
+
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > max_size:
+                raise PDFTooLarge(f"{url} is over {max_size} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+
+def download_many(
+    urls: Iterable[str], workers: int = 4, **kwargs
+) -> Iterator[Tuple[str, Union[bytes, Exception]]]:
+    """Download PDFs concurrently, in order, ahead of the caller
+
+    Up to `workers` downloads run in the background while the caller works
+    on the PDF it was just given, so downloading overlaps with extraction.
+    Failed downloads are yielded as their exception instead of raising.
+
+    :param urls: URLs of the PDFs
+    :param workers: Number of downloads to run at once
+    :param kwargs: Passed on to `download_pdf`
+    :return: Generator of (url, PDF bytes or exception)
+    """
+    urls = iter(urls)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for url in urls:
+            pending.append((url, pool.submit(download_pdf, url, **kwargs)))
+            if len(pending) >= workers:
+                break
+        while pending:
+            url, future = pending.pop(0)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = e
+            next_url = next(urls, None)
+            if next_url is not None:
+                pending.append(
+                    (next_url, pool.submit(download_pdf, next_url, **kwargs))
+                )
+            yield url, result
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+import functools
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from disclosure_extractor.image_processing import as_array, to_gray
+
+try:
+    import importlib.resources as importlib_resources
+except ImportError:
+    # In PY<3.7 fall-back to backported `importlib_resources`.
+    import importlib_resources
+
+
+# Glyphs are compared as bitmaps of this many pixels square
+GLYPH_SIZE = 20
+
+# Glyphs are blurred by this much, so stroke widths and serifs matter less
+GLYPH_BLUR = 1.0
+
+# Components shorter than this fraction of the tallest one are specks
+MIN_GLYPH_HEIGHT = 0.4
+
+# Codes matching their templates worse than this are left to tesseract
+MIN_GLYPH_SCORE = 0.5
+
+# ... as are codes that beat the next best code by less than this
+MIN_GLYPH_MARGIN = 0.1
+
+# ... or beat the best reading with a character swapped by less than this
+MIN_RIVAL_MARGIN = 0.05
+
+# Characters templates are made for: those the investment table codes are
+# made of, and others that would otherwise be mistaken for them
+TEMPLATE_CHARACTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+
+def normalize_glyph(ink: np.ndarray) -> np.ndarray:
+    """Scale a glyph's ink into a centered square and flatten it
+
+    :param ink: Glyph mask, cropped to its ink
+    :return: Zero mean, unit length vector of the glyph
+    """
+    h, w = ink.shape
+    scale = GLYPH_SIZE / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    ink = cv2.resize(ink, size, interpolation=cv2.INTER_AREA)
+    square = np.zeros((GLYPH_SIZE, GLYPH_SIZE), dtype=np.float32)
+    top = (GLYPH_SIZE - ink.shape[0]) // 2
+    left = (GLYPH_SIZE - ink.shape[1]) // 2
+    square[top : top + ink.shape[0], left : left + ink.shape[1]] = ink
+    square = cv2.GaussianBlur(square, (0, 0), GLYPH_BLUR)
+    vector = square.ravel() - square.mean()
+    return vector / (np.linalg.norm(vector) or 1)
+
+
+def glyph_vectors(image) -> List[np.ndarray]:
+    """Split a cell into its glyphs, left to right
+
+    The cell is binarized with Otsu's threshold, specks are dropped, and
+    connected components that overlap horizontally, such as the halves of
+    a broken serif letter, are merged into one glyph.  Components that
+    only come within a pixel of each other are kept apart, so tightly
+    spaced characters are not read as one wide glyph.
+
+    :param image: Cleaned cell
+    :return: `normalize_glyph` vector of each glyph
+    """
+    gray = to_gray(np.ascontiguousarray(as_array(image)))
+    _, ink = cv2.threshold(
+        gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+    )
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:count]
+    if not len(stats):
+        return []
+    stats = stats[stats[:, 3] >= MIN_GLYPH_HEIGHT * stats[:, 3].max()]
+
+    boxes = []
+    for x, y, w, h, _ in sorted(stats.tolist()):
+        if boxes and x < boxes[-1][2]:
+            box = boxes[-1]
+            boxes[-1] = [
+                min(box[0], x),
+                min(box[1], y),
+                max(box[2], x + w),
+                max(box[3], y + h),
+            ]
+        else:
+            boxes.append([x, y, x + w, y + h])
+    return [normalize_glyph(ink[y0:y1, x0:x1]) for x0, y0, x1, y1 in boxes]
+
+
+def render_glyph(character: str, font_path: str, size: int) -> np.ndarray:
+    """Draw a character black on white, for building templates
+
+    :param character: Character to draw
+    :param font_path: TrueType font to draw it in
+    :param size: Font size in pixels
+    :return: Grayscale image of the character
+    """
+    font = ImageFont.truetype(font_path, size)
+    image = Image.new("L", (size * 2, size * 2), 255)
+    ImageDraw.Draw(image).text(
+        (size // 2, size // 4), character, fill=0, font=font
+    )
+    return np.asarray(image)
+
+
+class GlyphClassifier:
+    """Nearest neighbour recognizer for the investment table codes
+
+    Each glyph of a cell is scored against every template of each
+    character by correlation.  A code scores as its worst matching glyph,
+    and only the codes allowed in the cell's column are considered, so an
+    O is never read where a Q belongs.  Cells that are not a confident
+    match for a single code are left for tesseract.
+    """
+
+    def __init__(self, vectors: np.ndarray, labels: Sequence[str]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms, norms, 1)
+        self.labels = np.asarray(labels)
+        self.characters = {
+            character: self.vectors[self.labels == character]
+            for character in set(self.labels.tolist())
+        }
+
+    @classmethod
+    def from_fonts(
+        cls, font_paths: Iterable[str], sizes: Iterable[int] = (20, 32)
+    ) -> "GlyphClassifier":
+        """Build templates of every template character from fonts
+
+        :param font_paths: TrueType fonts to render the characters in
+        :param sizes: Font sizes to render at
+        :return: The classifier
+        """
+        vectors, labels = [], []
+        for font_path in font_paths:
+            for size in sizes:
+                for character in TEMPLATE_CHARACTERS:
+                    glyphs = glyph_vectors(
+                        render_glyph(character, font_path, size)
+                    )
+                    vectors.extend(glyphs[:1])
+                    labels.extend(character for _ in glyphs[:1])
+        return cls(np.array(vectors), labels)
+
+    @classmethod
+    def from_samples(
+        cls, images: Iterable, texts: Iterable[str]
+    ) -> "GlyphClassifier":
+        """Build templates from cells whose text is known
+
+        Cells that don't split into one glyph per character are skipped.
+
+        :param images: Cleaned cells, e.g. from scanned disclosures
+        :param texts: Text of each cell
+        :return: The classifier
+        """
+        vectors, labels = [], []
+        for image, text in zip(images, texts):
+            glyphs = glyph_vectors(image)
+            if len(glyphs) == len(text):
+                vectors.extend(glyphs)
+                labels.extend(text)
+        return cls(np.array(vectors), labels)
+
+    def merge(self, other: "GlyphClassifier") -> "GlyphClassifier":
+        """A classifier with the templates of both"""
+        return GlyphClassifier(
+            np.concatenate([self.vectors, other.vectors]),
+            np.concatenate([self.labels, other.labels]),
+        )
+
+    @classmethod
+    def load(cls, path=None) -> "GlyphClassifier":
+        """Load templates saved with `save`, by default those we ship
+
+        :param path: File to load, or None for the bundled templates
+        :return: The classifier
+        """
+        if path is None:
+            path = importlib_resources.open_binary(
+                "disclosure_extractor", "code_glyphs.npz"
+            )
+        with np.load(path) as templates:
+            return cls(templates["vectors"], templates["labels"])
+
+    def save(self, path) -> None:
+        """Save the templates, quantized to bytes and compressed
+
+        :param path: File to save to
+        :return: None
+        """
+        peaks = np.abs(self.vectors).max(axis=1, keepdims=True)
+        vectors = np.round(self.vectors * 127 / np.where(peaks, peaks, 1))
+        np.savez_compressed(
+            path, vectors=vectors.astype(np.int8), labels=self.labels
+        )
+
+    def _matches(self, image) -> List[Dict[str, float]]:
+        """Best template score of each character, for each glyph of a cell"""
+        return [
+            {
+                character: float((templates @ glyph).max())
+                for character, templates in self.characters.items()
+            }
+            for glyph in glyph_vectors(image)
+        ]
+
+    @staticmethod
+    def _score(
+        matches: List[Dict[str, float]], possibilities: Iterable[str]
+    ) -> List[Tuple[str, float]]:
+        scored = [
+            (code, min(match[c] for c, match in zip(code, matches)))
+            for code in possibilities
+            if len(code) == len(matches)
+        ]
+        return sorted(scored, key=lambda pair: -pair[1])
+
+    def scores(
+        self, image, possibilities: Iterable[str]
+    ) -> List[Tuple[str, float]]:
+        """Score a cell as each of the possible codes, best first
+
+        A code scores as its worst matching glyph.
+
+        :param image: Cleaned cell
+        :param possibilities: Codes allowed in the cell
+        :return: (code, score) pairs for codes with as many glyphs as the cell
+        """
+        return self._score(self._matches(image), possibilities)
+
+    def classify(self, image, possibilities: Iterable[str]) -> Optional[str]:
+        """Read a cell as one of the possible codes, if we are sure
+
+        The best code must beat the next best allowed code, and also the
+        best reading with one of its characters swapped for any other,
+        allowed in the column or not, so a stray digit is never read as
+        the nearest allowed letter.
+
+        :param image: Cleaned cell
+        :param possibilities: Codes allowed in the cell
+        :return: The code, or None if tesseract should decide
+        """
+        matches = self._matches(image)
+        scored = self._score(matches, possibilities)
+        if not scored:
+            return None
+        code, score = scored[0]
+        runner_up = scored[1][1] if len(scored) > 1 else -1.0
+        rival = -1.0
+        for i, match in enumerate(matches):
+            swapped = max(
+                (v for c, v in match.items() if c != code[i]), default=-1.0
+            )
+            rest = [
+                m[c] for j, (c, m) in enumerate(zip(code, matches)) if j != i
+            ]
+            rival = max(rival, min(rest + [swapped]))
+        if (
+            score < MIN_GLYPH_SCORE
+            or score - runner_up < MIN_GLYPH_MARGIN
+            or score - rival < MIN_RIVAL_MARGIN
+        ):
+            return None
+        return code
+
+
+@functools.lru_cache(maxsize=None)
+def get_glyph_classifier() -> GlyphClassifier:
+    """The bundled code classifier, loaded once per process"""
+    return GlyphClassifier.load()
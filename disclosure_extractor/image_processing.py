@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import bisect
+import collections
+import functools
 import json
 import logging
-from itertools import groupby
-from typing import Dict, Union, List
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 
 import cv2
 import numpy as np
-import pandas as pd
+import PIL.Image
 from PIL.Image import Image
 
 try:
@@ -17,6 +21,200 @@ except ImportError:
     import importlib_resources
 
 
+# Page geometry the structure heuristics are tuned for
+PAGE_SIZE = (1653, 2180)
+
+# Section checkboxes scoring below this are checked, i.e. the section is empty
+SECTION_CUTOFF = 230
+
+# First page report type checkboxes scoring below this are checked
+LITTLE_CUTOFF = 220
+
+# Report type checkboxes on the first page, in the order they are read
+LITTLE_CHECKBOXES = ("nomination", "amended", "initial", "annual", "final")
+
+# Kinds of page told apart by `classify_page`
+BLANK_PAGE, TEXT_PAGE, FORM_PAGE = "blank", "text", "form"
+
+# Pages with less of their thumbnail inked than this are blank
+BLANK_INK = 0.002
+
+# Pages ruled with fewer long horizontal lines than this are not forms
+MIN_FORM_RULES = 3
+
+
+def as_array(image: Union[Image, np.ndarray]) -> np.ndarray:
+    """View a page or crop as a numpy array
+
+    Arrays, such as pages from a `PageStore`, are returned as they are so
+    that crops stay views of the page they came from.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    return np.array(image)
+
+
+def as_bgr(image: Union[Image, np.ndarray]) -> np.ndarray:
+    """OpenCV (BGR) version of an RGB image; grayscale is used as is"""
+    cv_image = as_array(image)
+    if cv_image.ndim == 2:
+        return cv_image
+    return cv_image[:, :, ::-1].copy()
+
+
+def prepare_page(page: Union[Image, np.ndarray]) -> np.ndarray:
+    """Convert a page once into the array its cells are cropped from
+
+    Cells cropped from the result are views of it, instead of PIL crops
+    that `find_redactions` and `clean_image` each convert again.  Scans
+    whose colour channels are all equal, which is nearly every disclosure,
+    are reduced to one channel so those per cell colour conversions are
+    skipped as well; the pixels they work on are the same.
+
+    :param page: Page image
+    :return: The page as a grayscale or RGB array
+    """
+    cv_image = as_array(page)
+    if cv_image.ndim == 3 and cv_image.shape[2] == 3:
+        first = cv_image[:, :, 0]
+        if np.array_equal(first, cv_image[:, :, 1]) and np.array_equal(
+            first, cv_image[:, :, 2]
+        ):
+            return np.ascontiguousarray(first)
+    return cv_image
+
+
+def image_size(image: Union[Image, np.ndarray]) -> Tuple[int, int]:
+    """Width and height of a PIL image or numpy array"""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def crop_image(
+    image: Union[Image, np.ndarray], box: Tuple
+) -> Union[Image, np.ndarray]:
+    """Crop like PIL's Image.crop, as a view when `image` is an array
+
+    Like PIL, the box is rounded to whole pixels and anything outside the
+    image is filled with black.
+    """
+    if not isinstance(image, np.ndarray):
+        return image.crop(box)
+    x0, y0, x1, y1 = [int(round(v)) for v in box]
+    height, width = image.shape[:2]
+    crop = image[max(y0, 0) : max(y1, 0), max(x0, 0) : max(x1, 0)]
+    if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+        padding = (
+            (max(-y0, 0), max(y1 - max(height, y0), 0)),
+            (max(-x0, 0), max(x1 - max(width, x0), 0)),
+        ) + ((0, 0),) * (image.ndim - 2)
+        crop = np.pad(crop, padding)
+    return crop
+
+
+def resize_image(
+    image: Union[Image, np.ndarray], size: Tuple[int, int]
+) -> Union[Image, np.ndarray]:
+    """Resize a PIL image or numpy array to (width, height)
+
+    Pages already rendered at that size are returned as they are.  Arrays
+    are resized through PIL too, so both give the same pixels.
+    """
+    if image_size(image) == tuple(size):
+        return image
+    if not isinstance(image, np.ndarray):
+        return image.resize(size)
+    return np.asarray(to_pil(image).resize(size))
+
+
+def to_pil(image: Union[Image, np.ndarray]) -> Image:
+    """PIL version of a numpy array; PIL images are used as is"""
+    if isinstance(image, np.ndarray):
+        return PIL.Image.fromarray(np.ascontiguousarray(image))
+    return image
+
+
+def fill_table(cv_image: np.ndarray) -> np.ndarray:
+    """Summed-area table of a page, for scoring boxes with `fill_scores`"""
+    return cv2.integral(cv_image, sdepth=cv2.CV_32S)
+
+
+def fill_scores(
+    table: np.ndarray, boxes: np.ndarray, legacy: bool = True
+) -> np.ndarray:
+    """Score how much ink is in each of many boxes, where lower means darker
+
+    Each box costs four lookups in the page's summed-area table.  The legacy
+    score is the mean of each colour channel truncated to uint8, summed and
+    divided by three, which is what SECTION_CUTOFF and LITTLE_CUTOFF were
+    tuned on; grayscale pages are scored as if their one channel were
+    three.  Otherwise the score is the plain mean.
+
+    :param table: Summed-area table from `fill_table`
+    :param boxes: (x, y, w, h) of each box
+    :param legacy: Whether to compute the legacy score
+    :return: Score of each box
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x, y, w, h = boxes.T
+    sums = (
+        table[y + h, x + w] - table[y, x + w] - table[y + h, x] + table[y, x]
+    ).reshape(len(boxes), -1)
+    # Multiply by the reciprocal of the area, as cv2.mean does
+    means = sums * (1.0 / (w * h))[:, None]
+    if not legacy:
+        return means.mean(axis=1)
+    means = means.astype(np.uint8)
+    if means.shape[1] == 1:
+        means = np.repeat(means, 3, axis=1)
+    # Sum as numpy 1.x did, without wrapping around at 255
+    return means.sum(axis=1, dtype=np.int64) / 3
+
+
+def fill_score(cv_image: np.ndarray, x: int, y: int, w: int, h: int):
+    """Score how much ink is in a single box, see `fill_scores`"""
+    crop = cv_image[y : y + h, x : x + w]
+    return fill_scores(fill_table(crop), [(0, 0, w, h)])[0]
+
+
+def apply_checkbox_cutoffs(
+    results: Dict,
+    section_cutoff: float = SECTION_CUTOFF,
+    little_cutoff: float = LITTLE_CUTOFF,
+) -> Dict:
+    """Decide again which checkboxes are checked from their recorded scores
+
+    Structure detection keeps the score of every checkbox it reads in
+    `results["checkbox_scores"]`, so the cutoffs can be tuned on saved
+    results without scanning the documents again.
+
+    Only sections with rows are marked, as during structure detection.
+    Extracted results have had the sections' "empty" flags removed, so only
+    their report type checkboxes are decided again.
+
+    :param results: Document structure or extracted results
+    :param section_cutoff: Cutoff for the section checkboxes
+    :param little_cutoff: Cutoff for the report type checkboxes
+    :return: Results with the checkboxes decided on the new cutoffs
+    """
+    scores = results.get("checkbox_scores", {})
+    for section, score in scores.get("sections", {}).items():
+        data = results["sections"][section]
+        if data["rows"] and "empty" in data:
+            data["empty"] = score < section_cutoff
+    for name, score in scores.get("little", {}).items():
+        results[name] = score < little_cutoff
+    return results
+
+
+def to_gray(cv_image: np.ndarray) -> np.ndarray:
+    """Grayscale version of a BGR image; grayscale is used as is"""
+    if cv_image.ndim == 2:
+        return cv_image
+    return cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+
+
 def clahe(img, clip_limit=1.0, grid_size=(8, 8)):
     clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=grid_size)
     return clahe.apply(img)
@@ -34,11 +232,95 @@ def determine_section_of_contour(checkboxes, rect):
     return max([x[5] for x in checkboxes])
 
 
-def load_template():
-    f = importlib_resources.read_text(
-        "disclosure_extractor", "extractor_template.json"
+class SectionIndex:
+    """Sorted index of section checkboxes for placing text lines
+
+    Gives the same answers as `determine_section_of_contour`, but keeps the
+    checkboxes of each page sorted by y as they are found, so each lookup
+    is a bisect instead of a filter and sort of every checkbox.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.pages = {}
+        self.last_section = None
+
+    def update(self, checkboxes: List) -> None:
+        """Add the checkboxes found since the last update
+
+        :param checkboxes: Every checkbox found so far, in order found
+        :return: None
+        """
+        for box in checkboxes[self.count :]:
+            ys, sections = self.pages.setdefault(box[4], ([], []))
+            # Insert after equal ys, as a stable sort would order them
+            position = bisect.bisect_right(ys, box[1])
+            ys.insert(position, box[1])
+            sections.insert(position, box[5])
+            if self.last_section is None or box[5] > self.last_section:
+                self.last_section = box[5]
+        self.count = len(checkboxes)
+
+    def section_of(self, rect: Tuple) -> str:
+        """Section of the nearest checkbox above a text line on its page
+
+        :param rect: Text line as (x, y, w, h, page, ...)
+        :return: Section name
+        """
+        ys, sections = self.pages.get(rect[4], ([], []))
+        position = bisect.bisect_left(ys, rect[1])
+        if position:
+            return sections[position - 1]
+        return self.last_section
+
+
+class Template:
+    """The extractor template, compiled for lookups
+
+    Holds the section order and each section's fields and field to column
+    index map as read-only tuples and mappings, so one instance can be
+    shared by every document.  `skeleton` gives a fresh, mutable result to
+    fill in for a document.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        sections = json.loads(text)["sections"]
+        self.sections = tuple(
+            sorted(sections, key=lambda name: sections[name]["order"])
+        )
+        self.by_order = MappingProxyType(
+            {sections[name]["order"]: name for name in self.sections}
+        )
+        self.fields = MappingProxyType(
+            {name: tuple(sections[name]["fields"]) for name in self.sections}
+        )
+        self.columns = MappingProxyType(
+            {
+                name: MappingProxyType(
+                    {field: i for i, field in enumerate(fields)}
+                )
+                for name, fields in self.fields.items()
+            }
+        )
+
+    def skeleton(self) -> Dict:
+        """A new, empty result for one document"""
+        return json.loads(self.text)
+
+
+@functools.lru_cache(maxsize=None)
+def get_template() -> Template:
+    """The extractor template, read and compiled once per process"""
+    return Template(
+        importlib_resources.read_text(
+            "disclosure_extractor", "extractor_template.json"
+        )
     )
-    return json.loads(f)
+
+
+def load_template():
+    return get_template().skeleton()
 
 
 def erode(image, q):
@@ -52,6 +334,137 @@ def erode(image, q):
     return cv2.erode(image, kernel, iterations=1)
 
 
+def contour_geometry(contours: Tuple) -> Tuple[np.ndarray, np.ndarray]:
+    """Bounding rectangles and areas of many contours at once
+
+    Matches `cv2.boundingRect` and `cv2.contourArea` for each contour, but
+    computes them for all of them in a few numpy operations.
+
+    :param contours: Contours from `cv2.findContours`
+    :return: (x, y, w, h) rows of bounding rectangles, and contour areas
+    """
+    if not len(contours):
+        return np.zeros((0, 4), dtype=np.int64), np.zeros(0)
+    lengths = np.array([len(contour) for contour in contours])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    x, y = points[:, 0], points[:, 1]
+
+    left = np.minimum.reduceat(x, starts)
+    top = np.minimum.reduceat(y, starts)
+    width = np.maximum.reduceat(x, starts) - left + 1
+    height = np.maximum.reduceat(y, starts) - top + 1
+    rects = np.stack([left, top, width, height], axis=1)
+
+    # Shoelace formula, with each contour closed on its first point
+    following = np.arange(len(points)) + 1
+    following[ends - 1] = starts
+    cross = x * y[following] - x[following] * y
+    areas = np.abs(np.add.reduceat(cross, starts)) / 2
+    return rects, areas
+
+
+def page_contours(
+    page_image: Union[Image, np.ndarray], scale: float = 1.0
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Threshold a page and measure the contours of everything on it
+
+    :param page_image: Page to find contours on
+    :param scale: Size of the page relative to the full page
+    :return: The page as an array, the contours' bounding rectangles,
+    their areas and the index of each one's parent contour (-1 for none)
+    """
+    cv_image = as_array(page_image)
+    image = process_image(cv_image, block_size=int(41 * scale) | 1)
+    contours, hierarchy = cv2.findContours(
+        image, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE
+    )
+    rects, areas = contour_geometry(contours)
+    if hierarchy is None:
+        parents = np.zeros(0, dtype=np.int64)
+    else:
+        parents = hierarchy[0, :, 3]
+    return cv_image, rects, areas, parents
+
+
+def classify_page(
+    page_image: Union[Image, np.ndarray], scale: float = 1.0
+) -> str:
+    """Tell blank pages and plain text pages from form pages, cheaply
+
+    Looks at a thumbnail of every other row and fourth column, which still
+    catches every table rule.  A page with hardly any ink is blank; one
+    with fewer than `MIN_FORM_RULES` lines across an eighth of the page,
+    such as a cover letter or the addendum, has no tables to find.
+
+    :param page_image: Page to classify
+    :param scale: Size of the page relative to the full page
+    :return: BLANK_PAGE, TEXT_PAGE or FORM_PAGE
+    """
+    row_step = max(1, int(round(2 * scale)))
+    column_step = max(1, int(round(4 * scale)))
+    thumbnail = as_array(page_image)[::row_step, ::column_step]
+    if thumbnail.ndim == 3:
+        thumbnail = to_gray(np.ascontiguousarray(thumbnail))
+    ink = (thumbnail < 160).astype(np.uint8)
+    if ink.mean() < BLANK_INK:
+        return BLANK_PAGE
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ink.shape[1] // 8, 1))
+    ruled = cv2.morphologyEx(ink, cv2.MORPH_OPEN, kernel).any(axis=1)
+    rules = np.count_nonzero(ruled[1:] & ~ruled[:-1]) + ruled[0]
+    if rules < MIN_FORM_RULES:
+        return TEXT_PAGE
+    return FORM_PAGE
+
+
+def _page_geometry(
+    page_image: Union[Image, np.ndarray], scale: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """`page_contours` without the page, to send back from a worker"""
+    return page_contours(page_image, scale)[1:]
+
+
+def iter_page_contours(
+    pages: Iterable, scale: float = 1.0, workers: int = 1
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """`page_contours` of each page, in page order
+
+    With more than one worker the pages are thresholded in a process pool.
+    Only two pages per worker are in flight at a time, so lazily rendered
+    pages are still rendered as they are needed, and only the contours'
+    geometry is sent back from the workers.  Pages given as None are
+    skipped, and yield None.
+
+    :param pages: Page images
+    :param scale: Size of the pages relative to the full pages
+    :param workers: Number of processes to use
+    :return: Generator of `page_contours` results
+    """
+    if workers <= 1:
+        for page in pages:
+            yield None if page is None else page_contours(page, scale)
+        return
+
+    def result(page, future):
+        if future is None:
+            return None
+        return (as_array(page),) + future.result()
+
+    pending = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for page in pages:
+            future = None
+            if page is not None:
+                future = pool.submit(_page_geometry, page, scale)
+            pending.append((page, future))
+            if len(pending) >= workers * 2:
+                yield result(*pending.popleft())
+        while pending:
+            yield result(*pending.popleft())
+
+
 def process_contours_page(
     page_image: Image,
     results: Dict[str, Union[str, int, float, List, Dict]],
@@ -63,145 +476,162 @@ def process_contours_page(
     little_checkboxes: List,
     s1: List,
     try_again: bool,
+    scale: float = 1.0,
+    contours: Tuple = None,
+    section_index: SectionIndex = None,
 ) -> Dict[str, Union[str, int, float, List, Dict]]:
-
+    """Find the checkboxes, text lines and table cells on a page
+
+    The size thresholds below were tuned on full resolution pages.  When
+    `page_image` is a reduced copy of the page, `scale` is its size relative
+    to the full page; thresholds shrink to match and every box is stored
+    in full page coordinates so it can be cropped from the full page.
+
+    Every contour is measured once, up front, and each kind of box is
+    picked out with a boolean mask over all of them.  `contours` is the
+    output of `page_contours` for the page, if it has already been computed.
+    `section_index` can be kept across pages so it is only updated with the
+    checkboxes found since.
+    """
     # Add to queue
 
-    mode = cv2.RETR_CCOMP
-    method = cv2.CHAIN_APPROX_SIMPLE
-    cv_image = np.array(page_image)
-    image = process_image(page_image)
-    height, width = image.shape
-    contours, hierarchy = cv2.findContours(image, mode, method)
+    if contours is None:
+        contours = page_contours(page_image, scale)
+    cv_image, rects, areas, parents = contours
+    template = get_template()
+    height, width = cv_image.shape[:2]
+    x, y, w, h = rects.T
+    extent = areas / (w * h)
+    aspect_ratio = w / h
+    square = (0.9 <= aspect_ratio) & (aspect_ratio <= 1.1) & (extent > 0.8)
+
+    def full_size(i):
+        if scale == 1:
+            return tuple(int(v) for v in rects[i])
+        return tuple(int(round(v / scale)) for v in rects[i])
 
     # Obtain the checkboxes on the page- to determine what section we are processing
     # do this first so we can remove any noise we might bump into on the top of the page
 
-    i = len(contours) - 1
+    is_checkbox = square & (x < width * 0.2)
+    if not try_again:
+        is_checkbox &= parents == -1
+    else:
+        is_checkbox &= parents > -1
+    # The first contour is never a checkbox
+    is_checkbox[:1] = False
+
+    # Find small checkboxes on first page  ** this need to be completed
+    is_little = np.zeros(len(rects), dtype=bool)
+    if pg_num == 0:
+        is_little = (
+            square
+            & (x > width * 0.2)
+            & (50 * scale > h)
+            & (h > 20 * scale)
+            & (parents == -1)
+        )
+
+    # Score every checkbox on the page at once
+    scores = np.zeros(len(rects))
+    scored = is_checkbox | is_little
+    if scored.any():
+        scores[scored] = fill_scores(fill_table(cv_image), rects[scored])
+    checkbox_scores = results.setdefault(
+        "checkbox_scores", {"sections": {}, "little": {}}
+    )
+
     checkboxes_on_page = []
-    while 0 < i:
-        cntr = contours[i]
-        area = cv2.contourArea(cntr)
-        x, y, w, h = cv2.boundingRect(cntr)
-        rect_area = w * h
-        extent = float(area) / rect_area
-        aspect_ratio = float(w) / h
-        if 0.9 <= aspect_ratio <= 1.1 and extent > 0.8 and x < width * 0.2:
-            if not try_again:
-                move_on = True if hierarchy[0, i, 3] == -1 else False
-            else:
-                move_on = True if hierarchy[0, i, 3] > -1 else False
-            if move_on:
-                checkboxes_on_page.append((x, y, w, h, pg_num))
-                sect_order = (
-                    len(checkboxes) + 1 if len(checkboxes) + 1 < 9 else 8
-                )
-                mean = (
-                    sum(
-                        np.array(
-                            cv2.mean(cv_image[y : y + h, x : x + w])
-                        ).astype(np.uint8)
-                    )
-                    / 3
-                )
-                is_empty = False
-                if mean < 230:
-                    is_empty = True
-
-                for k, sect in results["sections"].items():
-                    if sect["order"] == sect_order:
-                        section = k
-
-                checkboxes.append(
-                    (
-                        x,
-                        y,
-                        w,
-                        h,
-                        pg_num,
-                        section,
-                        {"is_section_empty": is_empty, "mean": mean},
-                    )
-                )
-                check[section] = is_empty
-        i -= 1
-    i = 0
+    for i in np.flatnonzero(is_checkbox)[::-1]:
+        checkboxes_on_page.append((x[i], y[i], w[i], h[i], pg_num))
+        fx, fy, fw, fh = full_size(i)
+        sect_order = len(checkboxes) + 1 if len(checkboxes) + 1 < 9 else 8
+        mean = scores[i]
+        is_empty = False
+        if mean < SECTION_CUTOFF:
+            is_empty = True
+
+        section = template.by_order[sect_order]
+
+        checkboxes.append(
+            (
+                fx,
+                fy,
+                fw,
+                fh,
+                pg_num,
+                section,
+                {"is_section_empty": is_empty, "mean": mean},
+            )
+        )
+        check[section] = is_empty
+        checkbox_scores["sections"][section] = float(mean)
     min_y = 0
     if checkboxes_on_page:
-        min_y = min([x[1] for x in checkboxes_on_page])
-
-    while i < len(contours):
-        cntr = contours[i]
-        area = cv2.contourArea(cntr)
-        x, y, w, h = cv2.boundingRect(cntr)
-        rect_area = w * h
-        extent = float(area) / rect_area
-        aspect_ratio = float(w) / h
-
-        # Date and name information
-        if (
-            y < height * 0.5 and h > 50 and x > width * 0.5 and pg_num == 0
-        ) or (height * 0.05 < y < height * 0.1 and h > 50 and pg_num == 0):
-            if hierarchy[0, i, 3] == -1:
-                # cv2.drawContours(cv_image, contours, i, (255, 70, 70))
-                s0.append((x, y, w, h))
-
-        # Cells for Investments and Trusts  √√√√√
-        # upper = 180 if height > 3000 else 80
-        # print(w, h, len(checkboxes))
-        if 10 > w / h > 0.9 and 150 > h > 40 and len(checkboxes) > 7:
-            # This lets me remove overlapping boxes,
-            # and take the inner, cleaner version
-            if hierarchy[0, i, 3] == -1:
-                # cv2.drawContours(cv_image, contours, i, (70, 70, 255))
-                s7.append(
-                    (
-                        x,
-                        y,
-                        w,
-                        h,
-                        pg_num,
-                        range(y, y + h),
-                        "Investments and Trusts",
-                    )
-                )
-
-        # Highlight text input lines  √√√√√√
-        if w / h > 7 and w > 150 and y > min_y:
-            # if hierarchy[0, i, 3] == -1:
-            rect = (x, y, w, h, pg_num, range(y, y + h))
-            if not checkboxes:
-                return results
-            section = determine_section_of_contour(checkboxes, rect)
-            # section = section_dict[section]['name']
-            rect = (x, y, w, h, pg_num, range(y, y + h), section)
-            s1.append(rect)
-            # cv2.drawContours(cv_image, contours, i, (70, 70, 255))
-        # Find small checkboxes on first page  ** this need to be completed
-        if (
-            0.9 <= aspect_ratio <= 1.1
-            and extent > 0.8
-            and x > width * 0.2
-            and 50 > h > 20
-            and pg_num == 0
-        ):
-            if hierarchy[0, i, 3] == -1:
-                # Process the little red checkbox at the start
-                # cv2.drawContours(cv_image, contours, i, (0, 0, 255))
-                mean = (
-                    sum(
-                        np.array(
-                            cv2.mean(cv_image[y : y + h, x : x + w])
-                        ).astype(np.uint8)
-                    )
-                    / 3
-                )
-                little_checkboxes.append((x, y, w, h, mean))
-                # font = cv2.FONT_HERSHEY_SIMPLEX
-                # cv2.putText(cv_image, str(int(mean)), (x, y), font, 1,
-                #             (0, 255, 0), 2, cv2.LINE_AA)
+        min_y = min([box[1] for box in checkboxes_on_page])
+
+    # Date and name information
+    is_s0 = np.zeros(len(rects), dtype=bool)
+    if pg_num == 0:
+        is_s0 = (
+            ((y < height * 0.5) & (h > 50 * scale) & (x > width * 0.5))
+            | ((height * 0.05 < y) & (y < height * 0.1) & (h > 50 * scale))
+        ) & (parents == -1)
+
+    # Cells for Investments and Trusts  √√√√√
+    # This lets me remove overlapping boxes,
+    # and take the inner, cleaner version
+    is_s7 = np.zeros(len(rects), dtype=bool)
+    if len(checkboxes) > 7:
+        is_s7 = (
+            (10 > aspect_ratio)
+            & (aspect_ratio > 0.9)
+            & (150 * scale > h)
+            & (h > 40 * scale)
+            & (parents == -1)
+        )
 
-        i += 1
+    # Highlight text input lines  √√√√√√
+    is_s1 = (aspect_ratio > 7) & (w > 150 * scale) & (y > min_y)
+
+    # Without any checkboxes the text lines can't be placed in a section,
+    # so give up on the page at the first one
+    last = len(rects)
+    if not checkboxes and is_s1.any():
+        last = np.flatnonzero(is_s1)[0]
+        is_s1[:] = False
+        is_little[last:] = False
+        last += 1
+
+    for i in np.flatnonzero(is_s0[:last]):
+        s0.append(full_size(i))
+    for i in np.flatnonzero(is_s7[:last]):
+        fx, fy, fw, fh = full_size(i)
+        s7.append(
+            (
+                fx,
+                fy,
+                fw,
+                fh,
+                pg_num,
+                range(fy, fy + fh),
+                "Investments and Trusts",
+            )
+        )
+    if section_index is None:
+        section_index = SectionIndex()
+    section_index.update(checkboxes)
+    for i in np.flatnonzero(is_s1):
+        fx, fy, fw, fh = full_size(i)
+        rect = (fx, fy, fw, fh, pg_num, range(fy, fy + fh))
+        section = section_index.section_of(rect)
+        rect = (fx, fy, fw, fh, pg_num, range(fy, fy + fh), section)
+        s1.append(rect)
+    for i in np.flatnonzero(is_little):
+        # Process the little red checkbox at the start
+        little_checkboxes.append((x[i], y[i], w[i], h[i], scores[i]))
+    if last < len(rects):
+        return results
 
     if pg_num == 0 and len(little_checkboxes) == 5:
         sorted_little_checkboxes = sorted(
@@ -212,11 +642,10 @@ def process_contours_page(
         initial, annual, final = sorted(
             sorted_little_checkboxes, key=lambda x: (x[0])
         )
-        results["nomination"] = True if nomination[4] < 220 else False
-        results["amended"] = True if amended[4] < 220 else False
-        results["initial"] = True if initial[4] < 220 else False
-        results["annual"] = True if annual[4] < 220 else False
-        results["final"] = True if final[4] < 220 else False
+        little = (nomination, amended, initial, annual, final)
+        for name, box in zip(LITTLE_CHECKBOXES, little):
+            results[name] = True if box[4] < LITTLE_CUTOFF else False
+            checkbox_scores["little"][name] = float(box[4])
 
     # Release from queue
     logging.info("Page contours extracted")
@@ -231,15 +660,10 @@ def process_i_row(results, investments, check):
     :param check:
     :return:
     """
-    investment_group = groupby(
-        investments["data"],
-        lambda content: content["group"],
-    )
-
     row_index = 0
-    for grouping in investment_group:
+    fields = get_template().fields["Investments and Trusts"]
+    for groups in investments:
         col_indx = 0
-        groups = list(grouping[1])
         results["sections"]["Investments and Trusts"]["rows"][row_index] = {}
         for group in sorted(groups, key=lambda x: x["x"]):
             group["coords"] = (
@@ -248,9 +672,7 @@ def process_i_row(results, investments, check):
                 (group["x"] + group["w"]),
                 (group["y"] + group["h"]),
             )
-            column = results["sections"]["Investments and Trusts"]["fields"][
-                col_indx
-            ]
+            column = fields[col_indx]
             results["sections"]["Investments and Trusts"]["rows"][row_index][
                 column
             ] = group
@@ -276,20 +698,15 @@ def extract_other_data(results, check, other_sections):
     @param other_sections:
     @return:
     """
-    other_groups = groupby(
-        other_sections["data"],
-        lambda content: content["group"],
-    )
-
     row_index = 0
-    for grouping in other_groups:
+    template = get_template()
+    for groups in other_sections:
         col_indx = 0
-        groups = list(grouping[1])
         sect = groups[0]["section"]
         if results["sections"][sect]["rows"] == {}:
             row_index = 0
         results["sections"][sect]["rows"][row_index] = {}
-        if len(groups) != len(results["sections"][sect]["fields"]):
+        if len(groups) != len(template.fields[sect]):
             continue
         if sorted(groups, key=lambda x: x["x"])[0]["x"] > 120:
             continue
@@ -301,7 +718,7 @@ def extract_other_data(results, check, other_sections):
                 (group["y"] + group["h"]),
             )
             try:
-                column = results["sections"][sect]["fields"][col_indx]
+                column = template.fields[sect][col_indx]
                 results["sections"][sect]["rows"][row_index][column] = group
                 results["sections"][sect]["empty"] = check[sect]
                 col_indx += 1
@@ -311,129 +728,260 @@ def extract_other_data(results, check, other_sections):
     return results
 
 
-def group_together_investments(s7):
+def group_rows(boxes: List[Tuple]) -> List[List[Dict]]:
+    """Cluster boxes into the rows of a table
+
+    Boxes are sorted by page and y, and a new row starts wherever a box is
+    more than 10 pixels below the one before it.
+
+    :param boxes: (x, y, w, h, page, ...) of each box, with its section
+    seventh if known
+    :return: Rows of boxes, top to bottom, each box as a dict
     """
+    if not boxes:
+        return []
+    array = np.array([box[:5] for box in boxes], dtype=np.int64)
+    x, y, w, h, page = array.T
+    top = y + 10
+    order = np.lexsort((top, y, page))
+    ys, tops = y[order], top[order]
+    new_row = np.minimum(tops[1:], tops[:-1]) - np.maximum(ys[1:], ys[:-1]) < 0
+
+    rows = []
+    for group, indexes in enumerate(
+        np.split(order, np.flatnonzero(new_row) + 1)
+    ):
+        row = []
+        for i in indexes:
+            box = {
+                "index": int(i),
+                "x": int(x[i]),
+                "y": int(y[i]),
+                "w": int(w[i]),
+                "h": int(h[i]),
+                "top": int(top[i]),
+                "page": int(page[i]),
+            }
+            if len(boxes[i]) > 6:
+                box["section"] = boxes[i][6]
+            box["group"] = group
+            row.append(box)
+        rows.append(row)
+    return rows
 
-    :param s7:
-    :return:
+
+def group_together_investments(s7):
+    """Rows of investment cells, keeping only complete rows of ten
+
+    :param s7: Investment cells
+    :return: Rows of cells
     """
-    df = pd.DataFrame(
-        {
-            "x": [x[0] for x in s7],
-            "y": [x[1] for x in s7],
-            "w": [x[2] for x in s7],
-            "h": [x[3] for x in s7],
-            "top": [x[1] + 10 for x in s7],
-            "page": [x[4] for x in s7],
-            "section": "Investments and Trusts",
-        }
-    )
-    df = df.sort_values(["page", "y", "top"])
-    df["group"] = (
-        (
-            df.top.rolling(window=2, min_periods=1).min()
-            - df.y.rolling(window=2, min_periods=1).max()
-        )
-        < 0
-    ).cumsum()
-    ndf = df.groupby("group").filter(lambda x: len(x) == 10)
-    investments = json.loads(ndf.to_json(orient="table"))
-    return investments
+    return [row for row in group_rows(s7) if len(row) == 10]
 
 
 def group_other_sections(s1):
-    """
+    """Rows of text lines outside the investments, of two or more lines
 
-    @param s1:
-    @return:
+    :param s1: Text lines
+    :return: Rows of text lines
     """
-    df2 = pd.DataFrame(
+    rows = []
+    for row in group_rows(s1):
+        row = [
+            box for box in row if box["section"] != "Investments and Trusts"
+        ]
+        if len(row) > 1:
+            rows.append(row)
+    return rows
+
+
+def extract_structures(
+    pages: List[Image],
+    policies: Iterable[bool],
+    scale: float = 1.0,
+    workers: int = 1,
+    skip_blank: bool = False,
+) -> List[Dict]:
+    """Find the document structure under several checkbox policies at once
+
+    Each page is thresholded and its contours found only once, and then
+    classified under every policy, so trying the fallback checkbox
+    hierarchy costs no extra pass over the pages.  The redaction boxes
+    found on each page along the way are kept under "redactions", for
+    `RedactionMap`.
+
+    Thresholding and finding contours is independent for each page and can
+    be spread over `workers` processes.  The pages' contours are then
+    classified in page order, since the section of each checkbox depends on
+    how many were found before it, so the structure is the same for any
+    number of workers.
+
+    With `skip_blank` each page is first sorted by `classify_page`, and only
+    form pages are thresholded.  The kind of every page is kept under
+    "page_kinds".
+
+    :param pages: Page images to find the document structure on
+    :param policies: `try_again` values to find the structure with
+    :param scale: Size of `pages` relative to the pages the content will be
+    cropped from, for finding structure on cheaper, low resolution renders
+    :param workers: Number of processes to find contours with
+    :param skip_blank: Should blank and plain text pages be skipped
+    :return: Document structure for each policy
+    """
+    states = [
         {
-            "x": [x[0] for x in s1],
-            "y": [x[1] for x in s1],
-            "w": [x[2] for x in s1],
-            "h": [x[3] for x in s1],
-            "top": [x[1] + 10 for x in s1],
-            "page": [x[4] for x in s1],
-            "section": [x[6] for x in s1],
+            "try_again": try_again,
+            "results": load_template(),
+            "check": {},
+            "checkboxes": [],
+            "s0": [],
+            "s1": [],
+            "s7": [],
+            "little_checkboxes": [],
+            "section_index": SectionIndex(),
         }
-    )
-    df2 = df2.sort_values(["page", "y", "top"])
-    df2["group"] = (
-        (
-            df2.top.rolling(window=2, min_periods=1).min()
-            - df2.y.rolling(window=2, min_periods=1).max()
-        )
-        < 0
-    ).cumsum()
-
-    df2 = df2[df2.section != "Investments and Trusts"]
-    ndf2 = df2.groupby("group").filter(lambda x: len(x) > 1)
-    other_sections = json.loads(ndf2.to_json(orient="table"))
-    return other_sections
-
+        for try_again in policies
+    ]
+    page_kinds = []
+
+    def form_pages():
+        for page in pages:
+            page_kinds.append(classify_page(page, scale))
+            if page_kinds[-1] != FORM_PAGE:
+                logging.info(f"Skipping {page_kinds[-1]} page")
+                page = None
+            yield page
+
+    redactions = {}
+    pg_num = 0
+    pages_to_search = form_pages() if skip_blank else pages
+    for contours in iter_page_contours(pages_to_search, scale, workers):
+        if contours is None:
+            redactions[pg_num] = []
+            pg_num += 1
+            continue
+        cv_image, rects, areas, _ = contours
+        redactions[pg_num] = [
+            tuple(int(round(v / scale)) for v in rect)
+            for rect in rects[is_redaction_box(rects, areas, scale)]
+        ]
+        for state in states:
+            state["results"] = process_contours_page(
+                cv_image,
+                state["results"],
+                pg_num,
+                state["checkboxes"],
+                state["check"],
+                state["s0"],
+                state["s7"],
+                state["little_checkboxes"],
+                state["s1"],
+                state["try_again"],
+                scale,
+                contours,
+                state["section_index"],
+            )
+        pg_num += 1
 
-def extract_contours_from_page(pages: List[Image], try_again):
+    structures = []
+    for state in states:
+        results, check = state["results"], state["check"]
+
+        # Here is where we do some data processing and group rows together
+        # sometimes things need to be massaged a bit.
+
+        # Extract investment table data
+        investments = group_together_investments(state["s7"])
+        results = process_i_row(results, investments, check)
+
+        # Extract sections I to VI
+        other_sections = group_other_sections(state["s1"])
+        results = extract_other_data(results, check, other_sections)
+
+        results["first_four"] = state["s0"]
+        results["redactions"] = redactions
+        if skip_blank:
+            results["page_kinds"] = page_kinds
+        results["page_count"] = pg_num
+        results["found_count"] = len(state["checkboxes"])
+        structures.append(results)
+    return structures
+
+
+def extract_contours_from_page(
+    pages: List[Image],
+    try_again,
+    scale: float = 1.0,
+    workers: int = 1,
+    skip_blank: bool = False,
+):
     """Process PDF
 
     Return the document structure as JSON data to easily and accurately
     extract out the information.
-    """
-    results = load_template()
-    check = {}
-    checkboxes, s0, s1, s7 = [], [], [], []
-    little_checkboxes = []
-    pg_num = 0
-    for page in pages:
-        results = process_contours_page(
-            page,
-            results,
-            pg_num,
-            checkboxes,
-            check,
-            s0,
-            s7,
-            little_checkboxes,
-            s1,
-            try_again,
-        )
-        pg_num += 1
-
-    # Here is where we do some data processing and group rows together
-    # sometimes things need to be massaged a bit.
-
-    # Extract investment table data
-    investments = group_together_investments(s7)
-    results = process_i_row(results, investments, check)
 
-    # Extract sections I to VI
-    other_sections = group_other_sections(s1)
-    results = extract_other_data(results, check, other_sections)
-
-    results["first_four"] = s0
-    results["page_count"] = len(pages)
-    results["found_count"] = len(checkboxes)
-    return results
+    :param pages: Page images to find the document structure on
+    :param try_again: Whether to use the fallback checkbox hierarchy
+    :param scale: Size of `pages` relative to the pages the content will be
+    cropped from, for finding structure on cheaper, low resolution renders
+    :param workers: Number of processes to find contours with
+    :param skip_blank: Should blank and plain text pages be skipped
+    :return: Document structure
+    """
+    return extract_structures(pages, [try_again], scale, workers, skip_blank)[
+        0
+    ]
+
+
+def extract_document_structure(
+    pages: List[Image],
+    scale: float = 1.0,
+    min_found: int = 8,
+    workers: int = 1,
+    skip_blank: bool = False,
+) -> Dict:
+    """Find the document structure, falling back if checkboxes are missing
+
+    Both checkbox hierarchies are tried in a single pass over the pages.
+    The usual one wins if it finds `min_found` section checkboxes;
+    otherwise the fallback's structure is returned, whatever it found.
+
+    :param pages: Page images to find the document structure on
+    :param scale: Size of `pages` relative to the full pages
+    :param min_found: Number of section checkboxes a form should have
+    :param workers: Number of processes to find contours with
+    :param skip_blank: Should blank and plain text pages be skipped
+    :return: Document structure
+    """
+    structure, fallback = extract_structures(
+        pages, [False, True], scale, workers, skip_blank
+    )
+    if structure["found_count"] < min_found:
+        return fallback
+    return structure
 
 
-def process_image(input_image: Image) -> Image:
+def process_image(input_image: Image, block_size: int = 41) -> Image:
     """
 
     @param input_image:
+    @param block_size: Neighbourhood size for the adaptive threshold
     @return:
     """
-    cv_image = np.array(input_image)
-    src = cv_image[:, :, ::-1].copy()
-
-    # HSV thresholding to get rid of as much background as possible
-    hsv = cv2.cvtColor(src.copy(), cv2.COLOR_BGR2HSV)
-    mask = cv2.inRange(
-        src=hsv,
-        lowerb=np.array([0, 0, 0]),
-        upperb=np.array([255, 255, 255]),
-    )
-    result = cv2.bitwise_and(src, src, mask=mask)
-    _, gg, _ = cv2.split(result)
+    src = as_bgr(input_image)
+    if src.ndim == 2:
+        # Grayscale pages are already the single channel we want
+        gg = src
+    else:
+        # HSV thresholding to get rid of as much background as possible
+        hsv = cv2.cvtColor(src.copy(), cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(
+            src=hsv,
+            lowerb=np.array([0, 0, 0]),
+            upperb=np.array([255, 255, 255]),
+        )
+        result = cv2.bitwise_and(src, src, mask=mask)
+        _, gg, _ = cv2.split(result)
     gg = clahe(gg, 1, (3, 3))
 
     # Adaptive Thresholding to isolate the bed
@@ -442,7 +990,7 @@ def process_image(input_image: Image) -> Image:
         maxValue=255,
         adaptiveMethod=cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         thresholdType=cv2.THRESH_BINARY,
-        blockSize=41,  # maybe variable...
+        blockSize=block_size,
         C=2,
     )
     return image
@@ -460,19 +1008,58 @@ def find_redactions(image_crop: Image) -> bool:
     method = cv2.CHAIN_APPROX_SIMPLE
     image = process_image(image_crop)
     contours, hierarchy = cv2.findContours(image, mode, method)
+    rects, areas = contour_geometry(contours)
+    return bool(is_redaction_box(rects, areas).any())
 
-    i = 0
-    while i < len(contours):
-        cntr = contours[i]
-        area = cv2.contourArea(cntr)
-        x, y, w, h = cv2.boundingRect(cntr)
-        rect_area = w * h
-        extent = float(area) / rect_area
-        aspect_ratio = float(w) / h
-        if 0.9 <= aspect_ratio <= 10.1 and extent > 0.8 and 50 > h > 20:
-            return True
-        i += 1
-    return False
+
+def is_redaction_box(
+    rects: np.ndarray, areas: np.ndarray, scale: float = 1.0
+) -> np.ndarray:
+    """Which contours are shaped like redaction boxes
+
+    :param rects: (x, y, w, h) of each contour, from `contour_geometry`
+    :param areas: Area of each contour
+    :param scale: Size of the page relative to the full page
+    :return: Boolean mask over the contours
+    """
+    x, y, w, h = rects.T
+    extent = areas / (w * h)
+    aspect_ratio = w / h
+    return (
+        (0.9 <= aspect_ratio)
+        & (aspect_ratio <= 10.1)
+        & (extent > 0.8)
+        & (50 * scale > h)
+        & (h > 20 * scale)
+    )
+
+
+class RedactionMap:
+    """Every redaction box on a page, for looking up cells against
+
+    The boxes come from the page's structure pass (see
+    `extract_structures`), so checking a cell for redactions needs no
+    thresholding or contours of its own.  They are kept sorted by their
+    top edge; a lookup bisects to the boxes that start inside the cell and
+    checks whether any of them fits in it.
+    """
+
+    def __init__(self, boxes: Iterable[Tuple[int, int, int, int]]):
+        boxes = np.asarray(list(boxes), dtype=np.int64).reshape(-1, 4)
+        self.boxes = boxes[np.argsort(boxes[:, 1], kind="stable")]
+        self.tops = self.boxes[:, 1]
+
+    def is_redacted(self, box: Tuple) -> bool:
+        """Whether a redaction box lies inside a cell
+
+        :param box: Cell as (left, top, right, bottom), as for cropping
+        :return: Whether the cell is redacted
+        """
+        x0, y0, x1, y1 = [int(round(v)) for v in box]
+        start = np.searchsorted(self.tops, y0, side="left")
+        end = np.searchsorted(self.tops, y1, side="right")
+        x, y, w, h = self.boxes[start:end].T
+        return bool(((x >= x0) & (x + w <= x1) & (y + h <= y1)).any())
 
 
 class Error(Exception):
@@ -487,17 +1074,16 @@ class CheckboxesNotFound(Error):
     pass
 
 
-def clean_image(image_crop: Image) -> Image:
-    """Remove table lines that could be part of the image crop
+def remove_table_lines(image: np.ndarray) -> np.ndarray:
+    """Paint over the table lines in an image, in place
 
-    @param image_crop:
-    @return: Cleaned Image
-    """
-    image = np.array(image_crop)
-    # Convert RGB to BGR
-    image = image[:, :, ::-1].copy()
+    Vertical lines are all removed, horizontal ones only near the top or
+    bottom edge, where the borders of a cell or row are.
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    :param image: BGR or grayscale image to draw on
+    :return: The image
+    """
+    gray = to_gray(image)
     thresh = cv2.threshold(
         gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
     )[1]
@@ -511,7 +1097,7 @@ def clean_image(image_crop: Image) -> Image:
         detected_lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
     )
     cnts = cnts[0] if len(cnts) == 2 else cnts[1]
-    image_h, image_w, _ = image.shape
+    image_h, image_w = image.shape[:2]
     i = 0
     for c in cnts:
         x, y, w, h = cv2.boundingRect(c)
@@ -532,11 +1118,47 @@ def clean_image(image_crop: Image) -> Image:
     cnts = cnts[0] if len(cnts) == 2 else cnts[1]
     for c in cnts:
         cv2.drawContours(image, [c], -1, (255, 255, 255), 2)
+    return image
 
-    # Remove whitespace to improve tesseract
-    # image = cv2.imread(f)
-    original = image.copy()
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def remove_page_lines(image: Union[Image, np.ndarray]) -> np.ndarray:
+    """Erase the ruling lines of a whole page
+
+    Unlike `remove_table_lines`, which is made for single cells, only lines
+    much longer than a letter is tall are erased, so the text of the page
+    is left whole for OCR.
+
+    :param image: Page image
+    :return: Grayscale copy of the page without its lines
+    """
+    gray = to_gray(as_bgr(image)).copy()
+    _, ink = cv2.threshold(
+        gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+    )
+    h, w = gray.shape
+    # Letters are far shorter than these, table borders far longer
+    horizontal = cv2.morphologyEx(
+        ink,
+        cv2.MORPH_OPEN,
+        cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, w // 30), 1)),
+    )
+    vertical = cv2.morphologyEx(
+        ink,
+        cv2.MORPH_OPEN,
+        cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, h // 60))),
+    )
+    lines = cv2.dilate(horizontal | vertical, np.ones((3, 3), np.uint8))
+    gray[lines > 0] = 255
+    return gray
+
+
+def ink_mask(image: np.ndarray) -> np.ndarray:
+    """Mask of the blobs of text in an image, with specks removed
+
+    :param image: BGR or grayscale image
+    :return: Mask that is non-zero where there is text
+    """
+    gray = to_gray(image)
     blur = cv2.GaussianBlur(gray, (25, 25), 0)
     thresh = cv2.threshold(
         blur, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
@@ -548,10 +1170,28 @@ def clean_image(image_crop: Image) -> Image:
         thresh, cv2.MORPH_OPEN, noise_kernel, iterations=2
     )
     close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7))
-    close = cv2.morphologyEx(
+    return cv2.morphologyEx(
         opening, cv2.MORPH_CLOSE, close_kernel, iterations=3
     )
 
+
+def clean_image(image_crop: Image) -> Image:
+    """Remove table lines that could be part of the image crop
+
+    @param image_crop:
+    @return: Cleaned Image
+    """
+    # Convert RGB to BGR, and copy grayscale views as we draw on the image
+    image = as_bgr(image_crop)
+    if image.ndim == 2:
+        image = image.copy()
+    remove_table_lines(image)
+
+    # Remove whitespace to improve tesseract
+    # image = cv2.imread(f)
+    original = image.copy()
+    close = ink_mask(image)
+
     # Find enclosing bounding box and crop ROI
     coords = cv2.findNonZero(close)
     x, y, w, h = cv2.boundingRect(coords)
@@ -559,3 +1199,42 @@ def clean_image(image_crop: Image) -> Image:
     crop = original[y : y + h, x : x + w]
 
     return crop
+
+
+def clean_cells(
+    page: Union[Image, np.ndarray], boxes: List[Tuple]
+) -> List[np.ndarray]:
+    """Clean every cell of a table row in one pass over the row
+
+    Instead of a `clean_image` pipeline per cell, the strip of the page
+    covering the whole row has its table lines removed and its text found
+    once, and each cell is cut down to the text inside its own box.  The
+    results match `clean_image` except where its thresholds and blur would
+    have stopped at a cell's edge.  A cell with no text comes back empty.
+
+    :param page: Page image
+    :param boxes: Cells as (left, top, right, bottom), as for cropping
+    :return: The cleaned cells
+    """
+    boxes = [[int(round(v)) for v in box] for box in boxes]
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    right = max(box[2] for box in boxes)
+    bottom = max(box[3] for box in boxes)
+    strip = as_bgr(crop_image(page, (left, top, right, bottom)))
+    if strip.ndim == 2:
+        strip = strip.copy()
+    remove_table_lines(strip)
+    close = ink_mask(strip)
+
+    cells = []
+    for x0, y0, x1, y1 in boxes:
+        x0, x1 = x0 - left, x1 - left
+        y0, y1 = y0 - top, y1 - top
+        coords = cv2.findNonZero(close[y0:y1, x0:x1])
+        if coords is None:
+            cells.append(strip[y0:y0, x0:x0])
+            continue
+        x, y, w, h = cv2.boundingRect(coords)
+        cells.append(strip[y0 + y : y0 + y + h, x0 + x : x0 + x + w])
+    return cells
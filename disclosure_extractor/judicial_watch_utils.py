@@ -1,32 +1,40 @@
-import json
 import logging
-from itertools import groupby
 from typing import Dict, List, Union
 
 import cv2
 import numpy as np
-import pandas as pd
 from PIL import Image
 
-from disclosure_extractor.data_processing import ocr_slice, clean_stock_names
+from disclosure_extractor.data_processing import (
+    ocr_slice,
+    clean_stock_names,
+    map_threads,
+)
 from disclosure_extractor.image_processing import (
+    FORM_PAGE,
+    PAGE_SIZE,
+    as_bgr,
+    crop_image,
     find_redactions,
+    get_template,
+    group_rows,
+    image_size,
     load_template,
+    resize_image,
+    to_gray,
 )
 
 
 def box_extraction(page):
 
-    open_cv_image = np.array(page)
-    img = open_cv_image[:, :, ::-1].copy()
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = to_gray(as_bgr(page))
     (thresh, img_bin) = cv2.threshold(
         img, 128, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU
     )
     img_bin = 255 - img_bin
 
     # Defining a kernel length
-    kernel_length = np.array(img).shape[1] // 200
+    kernel_length = img.shape[1] // 200
 
     # A verticle kernel of (1 X kernel_length), which will
     # detect all the verticle lines from the image.
@@ -83,25 +91,29 @@ def get_investment_pages(
     pg_count = len(pages)
     if pg_count == "6":
         return pages[:3], pages[3:-2], pages[-2]
-    cv_image = np.array(pages[3])
+    cv_image = np.asarray(pages[3])
     avg_color_per_row = np.average(cv_image, axis=0)
-    avg_color = np.average(avg_color_per_row, axis=0)
+    avg_color = np.atleast_1d(np.average(avg_color_per_row, axis=0))
     if avg_color[0] > 245:
         return pages[:4], pages[4:-2], pages[-2]
     else:
         return pages[:3], pages[3:-2], pages[-2]
 
 
-def get_text_fields(non_investment_pages):
+def get_text_fields(non_investment_pages, kinds: List[str] = None):
     """
 
     :param non_investment_pages:
+    :param kinds: `classify_page` kind of each page; only forms are searched
     :return:
     """
     pg_num = 0
     s1 = []
     for page in non_investment_pages:
-        page = page.resize((1653, 2180))
+        if kinds and kinds[pg_num] != FORM_PAGE:
+            pg_num += 1
+            continue
+        page = resize_image(page, PAGE_SIZE)
         contours, hierarchy, _ = box_extraction(page)
         i = 0
         while i < len(contours):
@@ -121,39 +133,15 @@ def identify_sections(s1):
     :return:
     """
     results = load_template()
-    df2 = pd.DataFrame(
-        {
-            "x": [x[0] for x in s1],
-            "y": [x[1] for x in s1],
-            "w": [x[2] for x in s1],
-            "h": [x[3] for x in s1],
-            "top": [x[1] + 10 for x in s1],
-            "page": [x[4] for x in s1],
-        }
-    )
-
-    df2 = df2.sort_values(["page", "y", "top"])
-    df2["group"] = (
-        (
-            df2.top.rolling(window=2, min_periods=1).min()
-            - df2.y.rolling(window=2, min_periods=1).max()
-        )
-        < 0
-    ).cumsum()
-    ndf2 = df2.groupby("group").filter(lambda x: len(x) > 1)
-    other_sections = json.loads(ndf2.to_json(orient="table"))
-    other_groups = groupby(
-        other_sections["data"],
-        lambda content: content["group"],
-    )
+    template = get_template()
+    other_sections = [row for row in group_rows(s1) if len(row) > 1]
     section = None
     sect_name = None
     last_top = None
 
     row_index = 0
-    for grouping in other_groups:
+    for groups in other_sections:
         col_indx = 0
-        groups = list(grouping[1])
         ordered_grp = sorted(groups, key=lambda x: x["x"])
         if section is None:
             section = 1
@@ -198,7 +186,7 @@ def identify_sections(s1):
                 (group["y"] + group["h"]),
             )
             try:
-                column = results["sections"][sect_name]["fields"][col_indx]
+                column = template.fields[sect_name][col_indx]
 
                 results["sections"][sect_name]["rows"][row_index][
                     column
@@ -215,40 +203,67 @@ def identify_sections(s1):
     return results
 
 
+def read_text_cell(cell) -> Dict:
+    """OCR a cell of the text sections and check it for redactions
+
+    :param cell: (crop, column index to OCR it as)
+    :return: Text and redaction of the cell
+    """
+    crop, ocr_key = cell
+    return {
+        "text": ocr_slice(crop, ocr_key).strip(),
+        "is_redacted": find_redactions(crop),
+    }
+
+
 def extract_section_I_to_VI(
     results: Dict[str, Union[str, int, float, List, Dict]],
     pages: List[Image.Image],
+    workers: int = 1,
 ):
     """Extract data from the textfield sections i - vi
 
+    The cells of each page are OCR'd in `workers` threads, and written back
+    to the places they already hold in the results.
+
     :param results: Dxtracted data
     :param pages: List of images
+    :param workers: Number of threads to OCR cells with
     :return: Extracted data
     """
+    cells, places = [], []
+
+    def read_cells():
+        for (k, x, y), data in zip(
+            places, map_threads(read_text_cell, cells, workers)
+        ):
+            results["sections"][k]["rows"][x][y] = data
+        cells.clear()
+        places.clear()
+
     page_is = None
     for k, v in results["sections"].items():
         for x, row in v["rows"].items():
             ocr_key = 1
             for y, column in row.items():
                 if page_is == None or page_is != column["page"]:
+                    # Only keep one resized page around at a time
+                    read_cells()
                     page_is = column["page"]
                     old_page = pages[column["page"]]
-                    page = old_page.resize((1653, 2180))
+                    page = resize_image(old_page, PAGE_SIZE)
 
-                crop = page.crop(column["coords"])
+                crop = crop_image(page, column["coords"])
                 if column["section"] == "Liabilities":
                     ocr_key += 1
                     if ocr_key == 4:
-                        text = ocr_slice(crop, ocr_key).strip()
+                        cells.append((crop, ocr_key))
                     else:
-                        text = ocr_slice(crop, 1).strip()
+                        cells.append((crop, 1))
                 else:
-                    text = ocr_slice(crop, ocr_key).strip()
-                results["sections"][k]["rows"][x][y] = {}
-                results["sections"][k]["rows"][x][y]["text"] = text
-                results["sections"][k]["rows"][x][y][
-                    "is_redacted"
-                ] = find_redactions(crop)
+                    cells.append((crop, ocr_key))
+                places.append((k, x, y))
+    read_cells()
     return results
 
 
@@ -284,26 +299,40 @@ def process_page(page, row_count, results, pg_count):
     return results
 
 
-def extract_now(results, k, row, row_index, columns, pg_count):
+def extract_now(results, k, row, row_index, columns, pg_count, workers=1):
     """Extract from investments of judicial watch documents
 
+    With more than one worker every cell of the row is OCR'd at once, even
+    those after a cell that ends the row early.
+
     :param results: Our current extraction results
     :param k: The section
     :param row: the Row we are extracting
     :param row_index: the row count
     :param columns: The available columns
     :param pg_count: The page extraction is on
+    :param workers: Number of threads to OCR the row's cells with
     :return: Extracted content from row
     """
+    images = []
+    for item in row:
+        if item.ndim == 3:
+            item = cv2.cvtColor(item, cv2.COLOR_BGR2RGB)
+        images.append(Image.fromarray(item))
+    texts = None
+    if workers > 1:
+        texts = map_threads(
+            lambda cell: ocr_slice(cell[1], cell[0] + 1),
+            list(enumerate(images)),
+            workers,
+        )
 
     i = 0
     results["sections"][k]["rows"][row_index] = {}
-    for item in row:
+    for pil_image in images:
         column = columns[i]
         i += 1
-        color_coverted = cv2.cvtColor(item, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(color_coverted)
-        t = ocr_slice(pil_image, i)
+        t = texts[i - 1] if texts else ocr_slice(pil_image, i)
         if "description" in t.lower() or "assets" in t.lower():
             # If this is a bad PDF we may extract from the addendum.
             # Check if we found it and move along.  Otherwise it could be
@@ -323,24 +352,30 @@ def extract_section_VII(
     results: Dict,
     investment_pages: List,
     pg_count: int,
+    kinds: List[str] = None,
+    workers: int = 1,
 ) -> Dict:
     """Extract content from investment pages on judicial watch documents
 
     :param results:
     :param investment_pages:
+    :param kinds: `classify_page` kind of each page; only forms are searched
+    :param workers: Number of threads to OCR each row's cells with
     :return:
     """
     k = "Investments and Trusts"
     columns = results["sections"]["Investments and Trusts"]["fields"]
     row_index = 0
-    for page in investment_pages:
+    for index, page in enumerate(investment_pages):
         pg_count += 1
+        if kinds and kinds[index] != FORM_PAGE:
+            continue
         data = extract_page(page)
         for row in data:
             if len(row) > len(columns):
                 continue
             results = extract_now(
-                results, k, row, row_index, columns, pg_count
+                results, k, row, row_index, columns, pg_count, workers
             )
             row_index += 1
         # Occasionally the judicial watch documents have multiple documents
@@ -356,14 +391,15 @@ def process_addendum(addendum_page) -> Dict:
     :param addendum_page:
     :return:
     """
-    width, height = addendum_page.size
-    slice = addendum_page.crop(
+    width, height = image_size(addendum_page)
+    slice = crop_image(
+        addendum_page,
         (
             0,
             height * 0.1,
             width,
             height * 0.95,
-        )
+        ),
     )
     return {
         "is_redacted": find_redactions(slice),
@@ -377,14 +413,14 @@ def extract_page(page: Image) -> List[List]:
     :param page:
     :return:
     """
-    max_x = 1653
-    max_y = 2180
+    max_x, max_y = PAGE_SIZE
     current_y, last_y, last_y_hit = 0, 0, 0
 
-    page = page.resize((max_x, max_y))
-    pil_image = page.convert("RGB")
-    open_cv_image = np.array(pil_image)
-    open_cv_image = open_cv_image[:, :, ::-1].copy()
+    page = resize_image(page, (max_x, max_y))
+    if isinstance(page, np.ndarray):
+        open_cv_image = page
+    else:
+        open_cv_image = as_bgr(page.convert("RGB"))
     _, _, processed_image = box_extraction(page)
 
     data = []
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL.Image import Image
+
+from disclosure_extractor.image_processing import as_array, to_gray
+
+# Cells are hashed at this height in pixels, whatever size they were cut at
+HASH_HEIGHT = 10
+
+# Specks with less ink than this fraction of the largest mark are ignored
+MIN_INK_AREA = 0.05
+
+
+def cell_hash(cleaned: Union[Image, np.ndarray]) -> str:
+    """Perceptual hash of a cleaned cell
+
+    The cell is binarized with Otsu's threshold, trimmed to its ink leaving
+    out specks, and scaled to `HASH_HEIGHT` keeping its aspect ratio, so
+    the same text cut from a slightly different place, or at a slightly
+    different scale, hashes the same.
+
+    :param cleaned: Cell with its table lines removed
+    :return: Hex digest
+    """
+    gray = to_gray(np.ascontiguousarray(as_array(cleaned)))
+    level, ink = cv2.threshold(
+        gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU
+    )
+    count, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:count]
+    if not len(stats):
+        return "blank"
+    areas = stats[:, cv2.CC_STAT_AREA]
+    stats = stats[areas >= MIN_INK_AREA * areas.max()]
+    x0, y0 = stats[:, 0].min(), stats[:, 1].min()
+    x1 = (stats[:, 0] + stats[:, 2]).max()
+    y1 = (stats[:, 1] + stats[:, 3]).max()
+    gray = gray[y0:y1, x0:x1]
+    h, w = gray.shape
+    width = max(1, round(w * HASH_HEIGHT / h))
+    small = cv2.resize(
+        gray, (width, HASH_HEIGHT), interpolation=cv2.INTER_AREA
+    )
+    bits = np.packbits(small <= level)
+    return hashlib.sha1(b"%d:" % width + bits.tobytes()).hexdigest()
+
+
+class OCRCache:
+    """Memo of what cells were OCR'd as
+
+    Scanned disclosures repeat the same few cells over and over: codes,
+    "None", dates.  Results are looked up by `cell_hash` and the way the
+    cell was OCR'd, and kept in memory until more than `max_entries` are
+    held, when the least recently used are dropped.  With `path` they are
+    also kept in a SQLite database there, which several processes and
+    later runs can share.  `hits` and `misses` count lookups.
+    """
+
+    def __init__(self, max_entries: int = 100000, path: str = None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Rows of a page may be OCR'd in threads sharing the cache
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    @staticmethod
+    def key(digest: str, mode: Tuple) -> str:
+        """Name a cell OCR'd a certain way
+
+        :param digest: `cell_hash` of the cell
+        :param mode: Anything that changes how the cell is OCR'd
+        :return: Cache key
+        """
+        return "-".join([digest] + [str(part) for part in mode])
+
+    def _store(self) -> Optional[sqlite3.Connection]:
+        # Connections must not be shared with forked worker processes
+        if self.path and self._db_pid != os.getpid():
+            self._db = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ocr "
+                "(key TEXT PRIMARY KEY, text TEXT NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, key: str) -> Optional[str]:
+        """What a cell was OCR'd as, or None if it hasn't been
+
+        :param key: Key from `OCRCache.key`
+        :return: The cell's text, if cached
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is None and self.path:
+                try:
+                    row = (
+                        self._store()
+                        .execute("SELECT text FROM ocr WHERE key = ?", (key,))
+                        .fetchone()
+                    )
+                except sqlite3.Error as e:
+                    logging.warning(f"Unable to read OCR cache: {e}")
+                    row = None
+                if row:
+                    text = row[0]
+                    self._remember(key, text)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: str, text: str) -> None:
+        """Remember what a cell was OCR'd as
+
+        :param key: Key from `OCRCache.key`
+        :param text: The cell's text
+        :return: None
+        """
+        with self._lock:
+            self._remember(key, text)
+            if self.path:
+                try:
+                    with self._store() as db:
+                        db.execute(
+                            "INSERT OR REPLACE INTO ocr VALUES (?, ?)",
+                            (key, text),
+                        )
+                except sqlite3.Error as e:
+                    logging.warning(f"Unable to write OCR cache: {e}")
+
+    def _remember(self, key: str, text: str) -> None:
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Hits, misses and entries held in memory"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+
+_ocr_cache = None
+
+
+def set_ocr_cache(
+    max_entries: Optional[int] = 100000, path: str = None
+) -> Optional[OCRCache]:
+    """Turn the OCR cache on for every extractor, or off with None
+
+    The cache can also be enabled, with a database shared across runs, by
+    pointing the DISCLOSURE_EXTRACTOR_OCR_CACHE environment variable at a
+    file.
+
+    :param max_entries: Most results to keep in memory
+    :param path: SQLite database to keep results in across runs
+    :return: The OCR cache in use
+    """
+    global _ocr_cache
+    _ocr_cache = OCRCache(max_entries, path) if max_entries else None
+    return _ocr_cache
+
+
+def get_ocr_cache() -> Optional[OCRCache]:
+    """The OCR cache in use, if any"""
+    return _ocr_cache
+
+
+if os.environ.get("DISCLOSURE_EXTRACTOR_OCR_CACHE"):
+    set_ocr_cache(path=os.environ["DISCLOSURE_EXTRACTOR_OCR_CACHE"])
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+
+def pdf_digest(file_path: str = None, pdf_bytes: bytes = None) -> str:
+    """SHA-256 of a PDF, used to address its rendered pages
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :return: Hex digest
+    """
+    sha = hashlib.sha256()
+    if pdf_bytes:
+        sha.update(pdf_bytes)
+    else:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+class PageCache:
+    """On-disk cache of rendered PDF pages
+
+    Pages are stored as losslessly compressed PNGs named after the PDF's
+    SHA-256 and the render settings, so a page comes back pixel for pixel
+    as it was rendered.  When the cache grows past `max_size` bytes the
+    least recently used pages are removed.  Several processes can safely
+    share one directory.
+    """
+
+    def __init__(self, directory: str, max_size: int = 2 * 1024**3):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, page_number: int) -> str:
+        return os.path.join(self.directory, f"{key}-{page_number}.png")
+
+    @staticmethod
+    def key(
+        digest: str,
+        dpi: int,
+        fmt: str,
+        resize: Optional[Tuple[int, int]],
+        size: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        """Name the renders of a PDF with a given set of settings"""
+        if size:
+            target = "s" + "x".join(str(v) for v in size)
+        elif resize:
+            target = "x".join(str(v) for v in resize)
+        else:
+            target = "native"
+        return f"{digest}-{dpi}-{fmt}-{target}"
+
+    def get(self, key: str, page_number: int) -> Optional[Image.Image]:
+        """Load a cached page, or None if it has not been rendered
+
+        :param key: Render key from `PageCache.key`
+        :param page_number: One-indexed page number
+        :return: The page image if cached
+        """
+        path = self._path(key, page_number)
+        try:
+            image = Image.open(path)
+            image.load()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return image
+
+    def get_many(
+        self, key: str, first_page: int, last_page: int
+    ) -> Optional[List[Image.Image]]:
+        """Load a range of cached pages, or None if any are missing"""
+        pages = []
+        for page_number in range(first_page, last_page + 1):
+            page = self.get(key, page_number)
+            if page is None:
+                return None
+            pages.append(page)
+        return pages
+
+    def put_many(
+        self, key: str, first_page: int, pages: List[Image.Image]
+    ) -> None:
+        """Store a range of pages and evict old pages if over the limit
+
+        :param key: Render key from `PageCache.key`
+        :param first_page: Page number of the first page in `pages`
+        :param pages: Rendered pages
+        :return: None
+        """
+        for page_number, page in enumerate(pages, start=first_page):
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    page.save(f, format="PNG", compress_level=1)
+                os.replace(tmp_path, self._path(key, page_number))
+            except OSError:
+                logging.warning("Unable to cache page %s" % page_number)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used pages until under the size limit"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".png"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_page_cache = None
+
+
+def set_page_cache(
+    directory: Optional[str], max_size: int = 2 * 1024**3
+) -> Optional[PageCache]:
+    """Turn the page cache on for every extractor, or off with None
+
+    The cache can also be enabled with the DISCLOSURE_EXTRACTOR_PAGE_CACHE
+    environment variable, and sized (in bytes) with
+    DISCLOSURE_EXTRACTOR_PAGE_CACHE_SIZE.
+
+    :param directory: Directory to keep rendered pages in
+    :param max_size: Maximum size of the cache in bytes
+    :return: The page cache in use
+    """
+    global _page_cache
+    _page_cache = PageCache(directory, max_size) if directory else None
+    return _page_cache
+
+
+def get_page_cache() -> Optional[PageCache]:
+    """The page cache in use, if any"""
+    return _page_cache
+
+
+if os.environ.get("DISCLOSURE_EXTRACTOR_PAGE_CACHE"):
+    set_page_cache(
+        os.environ["DISCLOSURE_EXTRACTOR_PAGE_CACHE"],
+        int(
+            os.environ.get("DISCLOSURE_EXTRACTOR_PAGE_CACHE_SIZE", 2 * 1024**3)
+        ),
+    )
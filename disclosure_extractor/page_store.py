@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from typing import Iterable, Iterator, Union
+
+import numpy as np
+from PIL.Image import Image
+
+
+class PageStore:
+    """Grayscale pages decoded once into memory-mapped arrays
+
+    Each page is kept as a uint8 `.npy` file in `directory` and opened
+    read-only with `numpy.memmap`, so any number of worker processes can
+    share a document's pages through the OS page cache without copying
+    them.  Pages, and crops sliced from them, are plain numpy views that
+    the image processing functions accept in place of PIL images.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.paths = sorted(
+            os.path.join(directory, name)
+            for name in os.listdir(directory)
+            if name.endswith(".npy")
+        )
+
+    @classmethod
+    def build(cls, directory: str, pages: Iterable[Image]) -> "PageStore":
+        """Decode pages into a new store, one page at a time
+
+        The store is written next to `directory` and moved into place once
+        complete, so readers never see a partial store.  If another process
+        finished the same store first, theirs is used.
+
+        :param directory: Where the store should live
+        :param pages: Page images, e.g. from `pages.iter_pages`
+        :return: The page store
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".page-store-")
+        try:
+            for pg_num, page in enumerate(pages):
+                array = np.asarray(page.convert("L"), dtype=np.uint8)
+                np.save(os.path.join(tmp_dir, f"{pg_num:05d}.npy"), array)
+            os.rename(tmp_dir, directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return cls(directory)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        return np.load(self.paths[index], mmap_mode="r")
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for index in range(len(self)):
+            yield self[index]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+from pdf2image import (
+    convert_from_bytes,
+    convert_from_path,
+    pdfinfo_from_bytes,
+    pdfinfo_from_path,
+)
+from PIL.Image import Image
+
+from disclosure_extractor.page_cache import (
+    PageCache,
+    get_page_cache,
+    pdf_digest,
+)
+from disclosure_extractor.page_store import PageStore
+
+
+def count_pages(file_path: str = None, pdf_bytes: bytes = None) -> int:
+    """Count the pages in a PDF without rendering it
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :return: Number of pages
+    """
+    if pdf_bytes:
+        info = pdfinfo_from_bytes(pdf_bytes)
+    else:
+        info = pdfinfo_from_path(file_path)
+    return int(info["Pages"])
+
+
+def render_pages(
+    file_path: str = None,
+    pdf_bytes: bytes = None,
+    first_page: int = None,
+    last_page: int = None,
+    dpi: int = 300,
+    fmt: str = "jpg",
+    resize: Optional[Tuple[int, int]] = None,
+    thread_count: int = 1,
+    digest: str = None,
+    size: Optional[Tuple[int, int]] = None,
+) -> List[Image]:
+    """Render a range of pages from a PDF
+
+    Page numbers are one-indexed and inclusive, matching pdftoppm.  If a
+    page cache is set up, pages already rendered with the same settings
+    are loaded from it instead.
+
+    `size` has pdftoppm render straight at (width, height), which is much
+    cheaper than rendering at `dpi` and then resizing with `resize`.
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :param first_page: First page to render
+    :param last_page: Last page to render
+    :param dpi: Resolution to render at
+    :param fmt: Image format used by pdftoppm
+    :param resize: Optional (width, height) to resize each page to
+    :param thread_count: Number of pdftoppm processes to use
+    :param digest: SHA-256 of the PDF, if already known
+    :param size: Optional (width, height) to render each page at
+    :return: Rendered pages
+    """
+    cache = get_page_cache()
+    if cache:
+        if digest is None:
+            digest = pdf_digest(file_path, pdf_bytes)
+        key = cache.key(digest, dpi, fmt, resize, size)
+        if last_page is None:
+            last_page = count_pages(file_path, pdf_bytes)
+        pages = cache.get_many(key, first_page or 1, last_page)
+        if pages is not None:
+            return pages
+
+    if pdf_bytes:
+        pages = convert_from_bytes(
+            pdf_bytes,
+            dpi=dpi,
+            fmt=fmt,
+            first_page=first_page,
+            last_page=last_page,
+            thread_count=thread_count,
+            size=size,
+        )
+    else:
+        pages = convert_from_path(
+            file_path,
+            dpi=dpi,
+            fmt=fmt,
+            first_page=first_page,
+            last_page=last_page,
+            thread_count=thread_count,
+            size=size,
+        )
+    if resize:
+        pages = [page.resize(resize) for page in pages]
+    if cache:
+        cache.put_many(key, first_page or 1, pages)
+    return pages
+
+
+def iter_pages(
+    file_path: str = None,
+    pdf_bytes: bytes = None,
+    dpi: int = 300,
+    fmt: str = "jpg",
+    resize: Optional[Tuple[int, int]] = None,
+    batch_size: int = 2,
+    page_count: int = None,
+    digest: str = None,
+    size: Optional[Tuple[int, int]] = None,
+) -> Iterator[Image]:
+    """Render a PDF lazily, a small page range at a time
+
+    Only `batch_size` pages are held in memory at once; each page is
+    released by the generator as soon as the caller moves on.
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :param dpi: Resolution to render at
+    :param fmt: Image format used by pdftoppm
+    :param resize: Optional (width, height) to resize each page to
+    :param batch_size: Number of pages rendered per pdftoppm call
+    :param page_count: Number of pages, if already known
+    :param digest: SHA-256 of the PDF, if already known
+    :param size: Optional (width, height) to render each page at
+    :return: Generator of page images
+    """
+    if page_count is None:
+        page_count = count_pages(file_path, pdf_bytes)
+    first_page = 1
+    while first_page <= page_count:
+        last_page = min(first_page + batch_size - 1, page_count)
+        batch = render_pages(
+            file_path,
+            pdf_bytes,
+            first_page=first_page,
+            last_page=last_page,
+            dpi=dpi,
+            fmt=fmt,
+            resize=resize,
+            thread_count=min(batch_size, 2),
+            digest=digest,
+            size=size,
+        )
+        while batch:
+            yield batch.pop(0)
+        first_page = last_page + 1
+
+
+def open_page_store(
+    directory: str,
+    file_path: str = None,
+    pdf_bytes: bytes = None,
+    dpi: int = 300,
+    fmt: str = "jpg",
+    resize: Optional[Tuple[int, int]] = None,
+    size: Optional[Tuple[int, int]] = None,
+) -> PageStore:
+    """Open the page store for a PDF, rendering it first if need be
+
+    Stores live in subdirectories of `directory` named like `PageCache`
+    keys, after the PDF's SHA-256 and the render settings, so a store is
+    only reused for the same PDF rendered the same way.
+
+    :param directory: Directory the page stores are kept in
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :param dpi: Resolution to render at
+    :param fmt: Image format used by pdftoppm
+    :param resize: Optional (width, height) to resize each page to
+    :param size: Optional (width, height) to render each page at
+    :return: The page store
+    """
+    key = PageCache.key(
+        pdf_digest(file_path, pdf_bytes), dpi, fmt, resize, size
+    )
+    directory = os.path.join(directory, key)
+    if os.path.isdir(directory):
+        return PageStore(directory)
+    logging.info("Building page store")
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    pages = iter_pages(
+        file_path, pdf_bytes, dpi=dpi, fmt=fmt, resize=resize, size=size
+    )
+    return PageStore.build(directory, pages)
+
+
+class PdfPages:
+    """Lazily rendered, list-like view over the pages of a PDF
+
+    Iterating streams the pages through `iter_pages`, while indexing renders
+    a single page on demand and keeps only the last `keep` of them around.
+    This lets the structure and OCR stages work one page at a time without
+    ever holding the whole document as images.
+    """
+
+    def __init__(
+        self,
+        file_path: str = None,
+        pdf_bytes: bytes = None,
+        dpi: int = 300,
+        fmt: str = "jpg",
+        resize: Optional[Tuple[int, int]] = None,
+        keep: int = 2,
+        size: Optional[Tuple[int, int]] = None,
+    ):
+        self.file_path = file_path
+        self.pdf_bytes = pdf_bytes
+        self.dpi = dpi
+        self.fmt = fmt
+        self.resize = resize
+        self.keep = keep
+        self.size = size
+        self.page_count = count_pages(file_path, pdf_bytes)
+        self.digest = (
+            pdf_digest(file_path, pdf_bytes) if get_page_cache() else None
+        )
+        self._recent = OrderedDict()
+
+    def __len__(self) -> int:
+        return self.page_count
+
+    def __iter__(self) -> Iterator[Image]:
+        return iter_pages(
+            self.file_path,
+            self.pdf_bytes,
+            dpi=self.dpi,
+            fmt=self.fmt,
+            resize=self.resize,
+            page_count=self.page_count,
+            digest=self.digest,
+            size=self.size,
+        )
+
+    def __getitem__(self, index: int) -> Image:
+        if index < 0:
+            index += self.page_count
+        if not 0 <= index < self.page_count:
+            raise IndexError("page index out of range")
+        if index in self._recent:
+            self._recent.move_to_end(index)
+            return self._recent[index]
+
+        logging.info(f"Rendering page {index + 1}")
+        page = render_pages(
+            self.file_path,
+            self.pdf_bytes,
+            first_page=index + 1,
+            last_page=index + 1,
+            dpi=self.dpi,
+            fmt=self.fmt,
+            resize=self.resize,
+            digest=self.digest,
+            size=self.size,
+        )[0]
+        self._recent[index] = page
+        while len(self._recent) > self.keep:
+            self._recent.popitem(last=False)
+        return page
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+
+import pdfplumber
+
+from disclosure_extractor.image_processing import (
+    PAGE_SIZE,
+    extract_structures,
+)
+from disclosure_extractor.pages import render_pages
+
+# Resolution of the checkbox probe; below this checkboxes start to drop out
+PROBE_DPI = 200
+
+# Fewest characters of text on the first page of a vector PDF
+MIN_TEXT_LENGTH = 100
+
+# Section checkboxes on the first page of the form, for parts I and II
+FIRST_PAGE_CHECKBOXES = 2
+
+
+def is_jef_font(fontname: str) -> bool:
+    """Is this one of the fonts the JEF filters look for"""
+    return "OpenSans" in fontname
+
+
+def count_checkboxes(file_path: str = None, pdf_bytes: bytes = None) -> int:
+    """Count the section checkboxes on a low resolution first page
+
+    Clean scans of the AO form have section checkboxes down the left side
+    of the first page; Judicial Watch style scans have none we can find.
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :return: Number of section checkboxes found
+    """
+    scale = PROBE_DPI / 300
+    size = (round(PAGE_SIZE[0] * scale), round(PAGE_SIZE[1] * scale))
+    page = render_pages(
+        file_path,
+        pdf_bytes,
+        first_page=1,
+        last_page=1,
+        dpi=PROBE_DPI,
+        resize=size,
+    )
+    structures = extract_structures(page, [False, True], scale)
+    return max(structure["found_count"] for structure in structures)
+
+
+def detect_format(file_path: str = None, pdf_bytes: bytes = None) -> str:
+    """Decide which extractor a financial disclosure needs
+
+    Only the first page is inspected, cheapest probe first:
+
+    - "jef": text set in the OpenSans fonts of the AO's new JEF forms
+    - "vector": real text laid out in ruled tables
+    - "scanned": an image of the form with the section checkboxes of its
+      first page, so a stray box shaped mark doesn't count
+    - "judicial_watch": any other scan
+
+    :param file_path: Location of the PDF
+    :param pdf_bytes: PDF as bytes
+    :return: Name of the extractor to use
+    """
+    source = io.BytesIO(pdf_bytes) if pdf_bytes else file_path
+    with pdfplumber.open(source) as pdf:
+        page = pdf.pages[0]
+        if any(is_jef_font(char["fontname"]) for char in page.chars):
+            return "jef"
+        text = page.extract_text() or ""
+        # Scans with an OCR text layer have text, but no ruling lines
+        if len(text) >= MIN_TEXT_LENGTH and (page.lines or page.rects):
+            return "vector"
+
+    logging.info("Probing first page for checkboxes")
+    if count_checkboxes(file_path, pdf_bytes) >= FIRST_PAGE_CHECKBOXES:
+        return "scanned"
+    return "judicial_watch"
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Rebuild the glyph templates bundled as disclosure_extractor/code_glyphs.npz
+
+Templates are rendered from fonts, and cut from the labelled cells of the
+scanned test disclosures listed in code_glyph_labels.json next to this
+script.  Each label gives the PDF, the page, the cell's box on the page
+rendered at 300 dpi and resized to PAGE_SIZE, and the cell's text.
+
+    python scripts/build_code_glyphs.py
+"""
+
+import argparse
+import json
+import os
+
+from disclosure_extractor.data_processing import prepare_cell
+from disclosure_extractor.glyphs import GlyphClassifier
+from disclosure_extractor.image_processing import (
+    PAGE_SIZE,
+    crop_image,
+    prepare_page,
+)
+from disclosure_extractor.pages import render_pages
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LABELS = os.path.join(os.path.dirname(__file__), "code_glyph_labels.json")
+ASSETS = os.path.join(ROOT, "tests", "test_assets")
+OUTPUT = os.path.join(ROOT, "disclosure_extractor", "code_glyphs.npz")
+FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+]
+
+
+def labelled_cells(labels_path: str, assets_dir: str):
+    """Cut each labelled cell from its page
+
+    :param labels_path: JSON list of {"pdf", "page", "box", "text"}
+    :param assets_dir: Directory the PDFs are in
+    :return: Cleaned cells and their texts
+    """
+    with open(labels_path) as f:
+        labels = json.load(f)
+    pages, cells, texts = {}, [], []
+    for label in labels:
+        if label["pdf"] not in pages:
+            pages[label["pdf"]] = [
+                prepare_page(page)
+                for page in render_pages(
+                    os.path.join(assets_dir, label["pdf"]),
+                    thread_count=10,
+                    resize=PAGE_SIZE,
+                )
+            ]
+        page = pages[label["pdf"]][label["page"]]
+        cells.append(prepare_cell(crop_image(page, label["box"])))
+        texts.append(label["text"])
+    return cells, texts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--labels", default=LABELS)
+    parser.add_argument("--assets", default=ASSETS)
+    parser.add_argument("--fonts", nargs="+", default=FONTS)
+    parser.add_argument("--output", default=OUTPUT)
+    args = parser.parse_args()
+
+    cells, texts = labelled_cells(args.labels, args.assets)
+    classifier = GlyphClassifier.from_fonts(args.fonts).merge(
+        GlyphClassifier.from_samples(cells, texts)
+    )
+    classifier.save(args.output)
+    print(f"Saved {len(classifier.labels)} templates to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,7 @@ setup(
     ],
     long_description=read("README.rst"),
     packages=find_packages(exclude=("tests",)),
-    package_data={"disclosure_extractor": ["*.json"]},
+    package_data={"disclosure_extractor": ["*.json", "*.npz"]},
     include_package_data=True,
     classifiers=[
         "Development Status :: 5 - Production/Stable",
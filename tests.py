@@ -7,17 +7,74 @@ from __future__ import (
 )
 
 import os
+import pathlib
 import pprint
+import tempfile
+import threading
+import time
 import unittest
-from unittest import TestCase
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase, mock
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
 
 from disclosure_extractor import (
+    EXTRACTORS,
     display_table,
+    extract_document,
     extract_financial_document,
+    extract_many,
     process_jef_document,
     process_judicial_watch,
     extract_vector_pdf,
 )
+from disclosure_extractor.data_processing import (
+    map_threads,
+    match_code,
+    WordIndex,
+    ocr_code_cascade,
+    ocr_date_cascade,
+    tile_cells,
+    words_by_tile,
+)
+from disclosure_extractor.glyphs import GlyphClassifier, glyph_vectors
+from disclosure_extractor.downloads import (
+    PDFTooLarge,
+    download_many,
+    download_pdf,
+)
+from disclosure_extractor.image_processing import (
+    BLANK_PAGE,
+    FORM_PAGE,
+    PAGE_SIZE,
+    TEXT_PAGE,
+    RedactionMap,
+    SectionIndex,
+    apply_checkbox_cutoffs,
+    classify_page,
+    clean_cells,
+    clean_image,
+    crop_image,
+    determine_section_of_contour,
+    extract_document_structure,
+    extract_structures,
+    fill_scores,
+    fill_table,
+    find_redactions,
+    get_template,
+    group_rows,
+    load_template,
+    prepare_page,
+    process_contours_page,
+)
+from disclosure_extractor.ocr_cache import OCRCache, cell_hash
+from disclosure_extractor.page_cache import PageCache
+from disclosure_extractor.page_store import PageStore
+from disclosure_extractor.pages import open_page_store, render_pages
+from disclosure_extractor.routing import detect_format
 
 
 class DisclosureTests(TestCase):
@@ -53,6 +110,36 @@ class DisclosureTests(TestCase):
         display_table(results)
         pprint.pprint(results)
 
+    def test_streaming_extraction(self):
+        """Can we extract a PDF while rendering it one page at a time?"""
+        pdf_path = os.path.join(self.assets_dir, "2011-Alito-J3.pdf")
+        results = extract_financial_document(
+            file_path=pdf_path, resize=True, stream=True
+        )
+        self.assertTrue(results["success"], msg="Process failed")
+
+    def test_scan_routing(self):
+        """Do we tell scans of the form from Judicial Watch scans?"""
+        for name, route in [
+            ("2011-Alito-J3.pdf", "scanned"),
+            ("2014-sample.pdf", "scanned"),
+            ("2004_judicial_watch.pdf", "judicial_watch"),
+        ]:
+            pdf_path = os.path.join(self.assets_dir, name)
+            self.assertEqual(detect_format(pdf_path), route, msg=name)
+
+    def test_skip_blank_pages(self):
+        """Are text pages skipped without losing any table rows?"""
+        pdf_path = os.path.join(self.assets_dir, "2014-sample.pdf")
+        pages = render_pages(pdf_path, resize=PAGE_SIZE)
+        structure = extract_document_structure(pages)
+        skipped = extract_document_structure(pages, skip_blank=True)
+        self.assertEqual(skipped["page_kinds"][4], TEXT_PAGE)
+        # The only change is an empty row made from the text page's lines
+        rows = structure["sections"]["Reimbursements"]["rows"]
+        self.assertEqual(rows.pop(5), {})
+        self.assertEqual(structure["sections"], skipped["sections"])
+
     def test_JEF_style_extraction(self):
         """Test if we can process a JEF processed PDF?"""
         pdf_path = os.path.join(self.assets_dir, "Lucero-C-J3.pdf")
@@ -93,6 +180,20 @@ class DisclosureTests(TestCase):
         )
 
 
+def pdf_size(file_path=None, pdf_bytes=None):
+    """Extractor that only measures the PDF it is given"""
+    return {"success": True, "msg": "", "pdf_size": len(pdf_bytes)}
+
+
+def crash_on_bad(file_path=None, pdf_bytes=None):
+    """Extractor that kills its worker process on the document 'bad'"""
+    if file_path == "bad":
+        os._exit(1)
+    # Still running when the pool breaks
+    time.sleep(0.5)
+    return {"success": True, "msg": ""}
+
+
 class ExtractNormalPDF(TestCase):
 
     root_dir = os.path.dirname(os.path.realpath(__file__))
@@ -115,6 +216,74 @@ class ExtractNormalPDF(TestCase):
             False,
         )
 
+    def test_extract_many(self):
+        """Can we extract a batch of PDFs and survive a bad one?"""
+        paths = [
+            os.path.join(self.assets_dir, "Alquist-NV-18.pdf"),
+            os.path.join(self.assets_dir, "missing.pdf"),
+            pathlib.Path(self.assets_dir, "addendum-redacted.pdf"),
+        ]
+        results = list(
+            extract_many(paths, workers=2, ordered=True, extractor="vector")
+        )
+        self.assertEqual([path for path, _ in results], paths)
+        self.assertEqual(
+            [result["success"] for _, result in results], [True, False, True]
+        )
+
+    def test_extract_many_worker_crash(self):
+        """Is only the document that kills its worker reported as failed?"""
+        with mock.patch.dict(EXTRACTORS, {"crashing": crash_on_bad}):
+            results = list(
+                extract_many(
+                    ["a", "b", "bad", "c"],
+                    workers=3,
+                    ordered=True,
+                    extractor="crashing",
+                )
+            )
+        self.assertEqual(
+            [(item, result["success"]) for item, result in results],
+            [("a", True), ("b", True), ("bad", False), ("c", True)],
+        )
+
+    def test_format_routing(self):
+        """Do we send each PDF to the right extractor?"""
+        jef_path = os.path.join(self.assets_dir, "Lucero-C-J3.pdf")
+        self.assertEqual(detect_format(jef_path), "jef")
+        pdf_path = os.path.join(self.assets_dir, "Alquist-NV-18.pdf")
+        with open(pdf_path, "rb") as f:
+            results = extract_document(pdf_bytes=f.read())
+        self.assertTrue(results["success"], msg="Extraction Failed")
+        self.assertEqual(results["route"], "vector")
+
+    def test_stray_checkbox_routing(self):
+        """Does a scan need the form's first page checkboxes to count?"""
+        pdf_path = os.path.join(self.assets_dir, "2004_judicial_watch.pdf")
+        for count, route in [(1, "judicial_watch"), (2, "scanned")]:
+            with mock.patch(
+                "disclosure_extractor.routing.count_checkboxes",
+                return_value=count,
+            ):
+                self.assertEqual(detect_format(pdf_path), route)
+
+    def test_scanned_routing(self):
+        """Do scanned PDFs reach structure detection with their pages?"""
+        page = Image.new("RGB", (1653, 2180), "white")
+        found = {"found_count": 0}
+        with mock.patch(
+            "disclosure_extractor.detect_format", return_value="scanned"
+        ), mock.patch(
+            "disclosure_extractor.render_pages", return_value=[page, page]
+        ) as render, mock.patch(
+            "disclosure_extractor.extract_document_structure",
+            return_value=found,
+        ) as structure:
+            results = extract_document(pdf_bytes=b"%PDF-1.4")
+        self.assertEqual(results["route"], "scanned")
+        self.assertEqual(render.call_args[1]["resize"], (1653, 2180))
+        self.assertEqual(len(structure.call_args[0][0]), 2)
+
     def test_redaction_addendum(self):
         """Can we identify redactions in the addendum?"""
         pdf_path = os.path.join(self.assets_dir, "addendum-redacted.pdf")
@@ -126,5 +295,631 @@ class ExtractNormalPDF(TestCase):
         )
 
 
+class PageCacheTest(TestCase):
+    def test_round_trip_and_eviction(self):
+        """Do cached pages come back unchanged and get evicted by age?"""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PageCache(directory, max_size=10**9)
+            key = PageCache.key("abc", 300, "jpg", (1653, 2180))
+            pages = [
+                Image.new("RGB", (40, 50), (i * 40, 0, 255 - i * 40))
+                for i in range(3)
+            ]
+            cache.put_many(key, 1, pages)
+            cached = cache.get_many(key, 1, 3)
+            self.assertEqual(
+                [page.tobytes() for page in cached],
+                [page.tobytes() for page in pages],
+            )
+            self.assertIsNone(cache.get_many(key, 1, 4))
+
+            cache.max_size = os.path.getsize(cache._path(key, 3))
+            os.utime(cache._path(key, 1), (1, 1))
+            os.utime(cache._path(key, 2), (2, 2))
+            cache.evict()
+            self.assertIsNone(cache.get(key, 1))
+            self.assertIsNone(cache.get(key, 2))
+            self.assertIsNotNone(cache.get(key, 3))
+
+
+class OCRCacheTest(TestCase):
+    def test_lookup_eviction_and_store(self):
+        """Are look alike cells shared, old ones evicted and saved ones kept?"""
+        cell = np.full((40, 120), 255, dtype=np.uint8)
+        cv2.putText(cell, "JT", (20, 30), 0, 0.8, 0, 2)
+        shifted = np.full((50, 140), 255, dtype=np.uint8)
+        shifted[7:47, 13:133] = cell
+        shifted[2, 2] = 0
+        other = np.full((40, 120), 255, dtype=np.uint8)
+        cv2.putText(other, "JK", (20, 30), 0, 0.8, 0, 2)
+        self.assertEqual(cell_hash(cell), cell_hash(shifted))
+        self.assertNotEqual(cell_hash(cell), cell_hash(other))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ocr.db")
+            cache = OCRCache(max_entries=2, path=path)
+            for i in range(3):
+                cache.put(OCRCache.key(str(i), (4, "C1")), str(i))
+            self.assertEqual(list(cache._entries), ["1-4-C1", "2-4-C1"])
+            self.assertEqual(cache.get("2-4-C1"), "2")
+            self.assertIsNone(cache.get("2-5-C2"))
+            self.assertEqual(cache.get("0-4-C1"), "0")
+            self.assertEqual(
+                cache.stats(), {"hits": 2, "misses": 1, "entries": 2}
+            )
+            self.assertEqual(OCRCache(path=path).get("1-4-C1"), "1")
+
+
+class PageStoreTest(TestCase):
+    def test_pages_are_shared_views(self):
+        """Are stored pages read-only views that crop like PIL?"""
+        page = Image.new("RGB", (30, 20), (200, 200, 200))
+        page.paste((10, 10, 10), (5, 5, 15, 10))
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = os.path.join(tmp, "store")
+            store = PageStore.build(directory, [page, page])
+            self.assertEqual(len(PageStore(directory)), 2)
+            array = store[0]
+            self.assertEqual(array.shape, (20, 30))
+            self.assertFalse(array.flags.writeable)
+
+            box = (0, 4, 12, 8)
+            crop = crop_image(array, box)
+            self.assertTrue(np.shares_memory(crop, array))
+            self.assertEqual(
+                crop.tolist(),
+                np.asarray(page.convert("L").crop(box)).tolist(),
+            )
+            box = (-3, -2, 8, 6)
+            self.assertEqual(
+                crop_image(array, box).tolist(),
+                np.asarray(page.convert("L").crop(box)).tolist(),
+            )
+
+    def test_stores_are_keyed_by_pdf_and_settings(self):
+        """Is a page store only reused for the same PDF and render?"""
+        page = Image.new("RGB", (30, 20), (200, 200, 200))
+        with tempfile.TemporaryDirectory() as tmp, mock.patch(
+            "disclosure_extractor.pages.iter_pages",
+            side_effect=lambda *args, **kwargs: iter([page]),
+        ) as render:
+            open_page_store(tmp, pdf_bytes=b"first")
+            open_page_store(tmp, pdf_bytes=b"first")
+            self.assertEqual(render.call_count, 1)
+            open_page_store(tmp, pdf_bytes=b"second")
+            open_page_store(tmp, pdf_bytes=b"first", dpi=200)
+            self.assertEqual(render.call_count, 3)
+            self.assertEqual(len(os.listdir(tmp)), 3)
+
+
+class FillScoreTest(TestCase):
+    def test_scores_match_box_means(self):
+        """Do table lookups score boxes like the mean of their crops?"""
+        rng = np.random.default_rng(0)
+        page = rng.integers(0, 256, (300, 200), dtype=np.uint8)
+        boxes = [(0, 0, 200, 300), (10, 20, 30, 40), (150, 250, 7, 3)]
+        table = fill_table(page)
+        for (x, y, w, h), score in zip(
+            boxes, fill_scores(table, boxes, legacy=False)
+        ):
+            self.assertAlmostEqual(score, page[y : y + h, x : x + w].mean())
+
+        # The legacy score sums three truncated channel means, unwrapped
+        page[:] = 240
+        self.assertEqual(fill_scores(fill_table(page), boxes)[1], 240)
+        page[:] = 255
+        self.assertEqual(fill_scores(fill_table(page), boxes)[1], 255)
+
+
+class CheckboxCutoffTest(TestCase):
+    def test_cutoffs_keep_the_results_schema(self):
+        """Are checkboxes decided again without adding keys to results?"""
+        structure = load_template()
+        structure["sections"]["Gifts"]["rows"][0] = {}
+        structure["checkbox_scores"] = {
+            "sections": {"Gifts": 200.0, "Positions": 200.0},
+            "little": {"annual": 200.0},
+        }
+        apply_checkbox_cutoffs(structure, section_cutoff=100)
+        self.assertFalse(structure["sections"]["Gifts"]["empty"])
+        self.assertIsNone(structure["sections"]["Positions"]["empty"])
+        self.assertTrue(structure["annual"])
+
+        results = {
+            "sections": {"Gifts": {"rows": [{}]}},
+            "checkbox_scores": {
+                "sections": {"Gifts": 200.0},
+                "little": {"annual": 200.0},
+            },
+        }
+        apply_checkbox_cutoffs(results, little_cutoff=150)
+        self.assertEqual(results["sections"]["Gifts"], {"rows": [{}]})
+        self.assertFalse(results["annual"])
+
+
+class PreparePageTest(TestCase):
+    def test_grayscale_scans_use_one_channel(self):
+        """Are cells of a gray scan processed the same from one channel?"""
+        rng = np.random.default_rng(0)
+        gray = rng.integers(200, 256, (400, 300), dtype=np.uint8)
+        gray[100:130, 50:100] = 0
+        page = Image.fromarray(gray).convert("RGB")
+        prepared = prepare_page(page)
+        self.assertEqual(prepared.shape, gray.shape)
+
+        box = (20, 80, 200, 160)
+        cell = crop_image(page, box)
+        self.assertEqual(
+            find_redactions(crop_image(prepared, box)), find_redactions(cell)
+        )
+        self.assertTrue(
+            np.array_equal(
+                clean_image(crop_image(prepared, box)),
+                clean_image(cell)[:, :, 0],
+            )
+        )
+
+        colour = np.dstack([gray, gray, 255 - gray])
+        self.assertEqual(prepare_page(colour).shape, colour.shape)
+
+
+class CleanCellsTest(TestCase):
+    def test_row_cleaned_in_one_pass(self):
+        """Are a row's cells cut down to their text like clean_image?"""
+        page = np.full((200, 600), 255, dtype=np.uint8)
+        page[50:53, :] = 0
+        page[120:123, :] = 0
+        for x in (0, 200, 400, 597):
+            page[50:123, x : x + 3] = 0
+        page[70:100, 30:150] = 0
+        page[75:95, 420:480] = 0
+        boxes = [(0, 50, 200, 123), (200, 50, 400, 123), (400, 50, 600, 123)]
+
+        cells = clean_cells(page, boxes)
+        self.assertEqual(cells[1].size, 0)
+        for box, cell in zip([boxes[0], boxes[2]], [cells[0], cells[2]]):
+            expected = clean_image(crop_image(page, box))
+            self.assertTrue(np.allclose(cell.shape, expected.shape, atol=2))
+            self.assertLess(cell.mean(), 64)
+
+
+class TiledOCRTest(TestCase):
+    def test_words_map_back_to_their_cells(self):
+        """Are words OCR'd from tiled cells given back to the right cell?"""
+        cells = [
+            np.zeros((30, 200), dtype=np.uint8),
+            np.zeros((60, 80), dtype=np.uint8),
+            np.zeros((25, 40), dtype=np.uint8),
+        ]
+        canvas, tops = tile_cells(cells, gap=40)
+        self.assertEqual(canvas.shape, (30 + 60 + 25 + 4 * 40, 280))
+        self.assertEqual(tops, [40, 110, 210])
+        self.assertTrue((canvas[tops[1] : tops[1] + 60, 40:120] == 0).all())
+        self.assertEqual(canvas[tops[1] - 1].min(), 255)
+
+        data = {
+            "text": ["", "Vanguard", "Fund", "Common", "Stock", " ", "H1"],
+            "top": [0, 42, 44, 112, 140, 150, 208],
+            "height": [400, 26, 24, 24, 24, 10, 28],
+        }
+        self.assertEqual(
+            words_by_tile(data, tops, 40),
+            ["Vanguard Fund", "Common Stock", "H1"],
+        )
+        self.assertEqual(match_code("h1.\n", 2), "H1")
+        self.assertIsNone(match_code("Common", 2))
+
+
+class OCRFallbackTest(TestCase):
+    @staticmethod
+    def extract(**kwargs):
+        """Extract a one row form with every tesseract run but one failing"""
+        page = np.full((2180, 1653), 255, dtype=np.uint8)
+        structure = load_template()
+        row = {}
+        for i, field in enumerate(["Position", "Name of Organization"]):
+            box = (200 + 500 * i, 300, 600 + 500 * i, 360)
+            cv2.putText(page, "Trustee", (box[0] + 20, 345), 0, 1.2, 0, 3)
+            row[field] = {"page": 0, "coords": box, "section": "Positions"}
+        structure["sections"]["Positions"]["rows"][0] = row
+        structure["found_count"] = 8
+        page = Image.fromarray(page).convert("RGB")
+        with mock.patch(
+            "disclosure_extractor.render_pages", return_value=[page, page]
+        ), mock.patch(
+            "disclosure_extractor.extract_document_structure",
+            return_value=structure,
+        ), mock.patch(
+            "pytesseract.image_to_data",
+            side_effect=pytesseract.TesseractError(1, "Error"),
+        ), mock.patch(
+            "pytesseract.image_to_string",
+            return_value="Member of the board of directors\n",
+        ):
+            return extract_financial_document(
+                pdf_bytes=b"%PDF-1.4", resize=True, **kwargs
+            )
+
+    def test_failed_batch_ocr_falls_back_to_cells(self):
+        """Are a page's cells OCR'd one at a time if its batch fails?"""
+        results = self.extract(batch_ocr=True)
+        self.assertTrue(results["success"], msg="Process failed")
+        self.assertEqual(
+            results["sections"]["Positions"]["rows"][0]["Position"]["text"],
+            "Member of the board of directors",
+        )
+
+    def test_failed_page_ocr_falls_back_to_cells(self):
+        """Are a page's cells OCR'd one at a time if its page OCR fails?"""
+        results = self.extract(page_ocr=True)
+        self.assertTrue(results["success"], msg="Process failed")
+        self.assertEqual(
+            results["sections"]["Positions"]["rows"][0]["Position"]["text"],
+            "Member of the board of directors",
+        )
+
+
+class GlyphClassifierTest(TestCase):
+    @staticmethod
+    def cell(text):
+        image = np.full((60, 40 * len(text) + 20), 255, dtype=np.uint8)
+        for i, character in enumerate(text):
+            cv2.putText(image, character, (10 + 40 * i, 48), 0, 1.2, 0, 3)
+        return image
+
+    def test_codes_read_from_their_glyphs(self):
+        """Are codes read by glyph, and other text left to tesseract?"""
+        self.assertEqual(len(glyph_vectors(self.cell("AJT"))), 3)
+        self.assertEqual(glyph_vectors(np.full((20, 20), 255, np.uint8)), [])
+
+        letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+        classifier = GlyphClassifier.from_samples(
+            [self.cell(letter) for letter in letters], letters
+        )
+        self.assertEqual(classifier.classify(self.cell("J"), "ABCDE"), None)
+        self.assertEqual(
+            classifier.classify(self.cell("KT"), ["J", "KT", "BT"]), "KT"
+        )
+        self.assertEqual(classifier.classify(self.cell("7"), "JKL"), None)
+        self.assertEqual(classifier.classify(self.cell("A"), "ABC"), "A")
+
+    def test_tightly_spaced_glyphs(self):
+        """Are characters a pixel apart kept apart, not read as a letter?"""
+        image = np.full((60, 100), 255, dtype=np.uint8)
+        x = 10
+        for character in "P4":
+            glyph = np.full((60, 60), 255, dtype=np.uint8)
+            cv2.putText(glyph, character, (10, 48), 0, 1.2, 0, 3)
+            columns = np.flatnonzero((glyph < 128).any(axis=0))
+            glyph = glyph[:, columns[0] : columns[-1] + 1]
+            image[:, x : x + glyph.shape[1]] = glyph
+            x += glyph.shape[1] + 1
+        self.assertEqual(len(glyph_vectors(image)), 2)
+
+        letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+        classifier = GlyphClassifier.from_samples(
+            [self.cell(letter) for letter in letters], letters
+        )
+        self.assertEqual(classifier.classify(image, "ABCDEFGHIJKLMNOP"), None)
+
+
+class ConfidentOCRTest(TestCase):
+    @staticmethod
+    def readings(*words):
+        """image_to_data results reading each (text, confidence) in turn"""
+        return [
+            {
+                "block_num": [1, 1],
+                "par_num": [1, 1],
+                "line_num": [0, 1],
+                "text": ["", text],
+                "conf": [-1, confidence],
+            }
+            for text, confidence in words
+        ]
+
+    def cascade(self, *words):
+        attempts = []
+        cell = Image.new("L", (40, 40), 255)
+        with mock.patch(
+            "pytesseract.image_to_data", side_effect=self.readings(*words)
+        ):
+            code = ocr_code_cascade(cell, 4, attempts)
+        return code, attempts
+
+    def test_cascade_stops_when_confident(self):
+        """Is OCR only repeated until tesseract is sure of a code?"""
+        self.assertEqual(
+            self.cascade(("J", 40), ("J.", 93)), ("J", [40.0, 93.0])
+        )
+        self.assertEqual(
+            self.cascade(("Q", 95), ("K", 30), ("", -1)),
+            ("K", [95.0, 30.0, 0.0]),
+        )
+        self.assertEqual(
+            self.cascade(("Q", 95), ("", -1), ("", -1)),
+            ("•", [95.0, 0.0, 0.0]),
+        )
+        self.assertEqual(
+            self.cascade(("Q", 20), ("", -1), ("", -1), ("L", 60)),
+            ("L", [20.0, 0.0, 0.0, 60.0]),
+        )
+
+        attempts = []
+        cell = Image.new("L", (40, 40), 255)
+        with mock.patch(
+            "pytesseract.image_to_data",
+            side_effect=self.readings(("6/2011", 91)),
+        ), mock.patch("pytesseract.image_to_string") as sharpened:
+            date = ocr_date_cascade(cell, cell, 7, attempts)
+        self.assertEqual((date, attempts), ("6/2011", [91.0]))
+        sharpened.assert_not_called()
+
+
+class WordIndexTest(TestCase):
+    def test_words_given_to_their_cells(self):
+        """Are a page's words put in order in the cell they fall in?"""
+        words = [
+            # text, left, top, width, height, confidence
+            ("Fund", 140, 112, 60, 20, 91),
+            ("Vanguard", 20, 110, 100, 22, 95),
+            ("Index", 20, 140, 70, 20, 90),
+            ("J", 320, 112, 15, 20, 96),
+            ("K", 330, 212, 15, 20, 40),
+            ("Spills", 250, 312, 100, 20, 93),
+            ("", 0, 0, 400, 400, -1),
+        ]
+        index = WordIndex(
+            {
+                "text": [w[0] for w in words],
+                "left": [w[1] for w in words],
+                "top": [w[2] for w in words],
+                "width": [w[3] for w in words],
+                "height": [w[4] for w in words],
+                "conf": [w[5] for w in words],
+            }
+        )
+        self.assertEqual(
+            index.text_of((10, 100, 300, 180)), "Vanguard Fund\nIndex"
+        )
+        self.assertEqual(index.text_of((300, 100, 400, 180)), "J")
+        self.assertEqual(index.text_of((10, 200, 300, 280)), "")
+        self.assertIsNone(index.text_of((300, 200, 400, 280)))
+        self.assertIsNone(index.text_of((300, 300, 400, 380)))
+
+
+class MapThreadsTest(TestCase):
+    def test_results_kept_in_order(self):
+        """Do threaded calls come back in the order they were made?"""
+        delays = [0.05, 0.0, 0.03, 0.01]
+
+        def slow(item):
+            time.sleep(delays[item])
+            return item * 2
+
+        self.assertEqual(map_threads(slow, [0, 1, 2, 3], 4), [0, 2, 4, 6])
+        self.assertEqual(map_threads(slow, [3, 1], 1), [6, 2])
+        self.assertEqual(map_threads(slow, [], 4), [])
+
+
+class ClassifyPageTest(TestCase):
+    def test_only_ruled_pages_are_forms(self):
+        """Are blank pages and letters told apart from ruled forms?"""
+        page = np.full((2180, 1653), 255, dtype=np.uint8)
+        self.assertEqual(classify_page(page), BLANK_PAGE)
+
+        # Lines of words, with gaps between them
+        for y in range(300, 1500, 40):
+            for x in range(150, 1200, 70):
+                page[y : y + 12, x : x + 50] = 0
+        self.assertEqual(classify_page(page), TEXT_PAGE)
+
+        for y in range(200, 1600, 100):
+            page[y : y + 3, 100:1550] = 0
+        self.assertEqual(classify_page(page), FORM_PAGE)
+        self.assertEqual(classify_page(page[::2, ::2], 0.5), FORM_PAGE)
+
+
+class TemplateTest(TestCase):
+    def test_template_is_compiled_once(self):
+        """Is the template shared, read-only and copied for each result?"""
+        template = get_template()
+        self.assertIs(template, get_template())
+        self.assertEqual(template.by_order[8], "Investments and Trusts")
+        self.assertEqual(template.columns["Gifts"]["Value"], 2)
+        with self.assertRaises(TypeError):
+            template.by_order[9] = "Addendum"
+
+        results = template.skeleton()
+        results["sections"]["Gifts"]["rows"][0] = {}
+        self.assertEqual(template.skeleton()["sections"]["Gifts"]["rows"], {})
+
+
+class RedactionMapTest(TestCase):
+    def test_cells_contain_redactions(self):
+        """Is a cell redacted only if a whole redaction box is inside it?"""
+        redactions = RedactionMap([(100, 200, 60, 30), (400, 50, 25, 25)])
+        self.assertTrue(redactions.is_redacted((90, 190, 170, 240)))
+        self.assertTrue(redactions.is_redacted((390, 40, 430, 80)))
+        self.assertFalse(redactions.is_redacted((90, 190, 150, 240)))
+        self.assertFalse(redactions.is_redacted((90, 210, 170, 260)))
+        self.assertFalse(RedactionMap([]).is_redacted((0, 0, 500, 500)))
+
+
+class StructureWorkersTest(TestCase):
+    def test_workers_find_the_same_structure(self):
+        """Is the structure the same when found in several processes?"""
+        pages = []
+        for n in range(3):
+            page = np.full((2180, 1653), 255, dtype=np.uint8)
+            for y in range(200 + n * 40, 2000, 240):
+                page[y : y + 40, 100:140] = 0
+                page[y + 60 : y + 62, 200:1500] = 0
+            pages.append(page)
+        self.assertEqual(
+            extract_structures(pages, [False, True], workers=2),
+            extract_structures(pages, [False, True]),
+        )
+
+
+class StructureScaleTest(TestCase):
+    @staticmethod
+    def structure(page, scale):
+        found = [], {}, [], [], [], []
+        process_contours_page(
+            page, load_template(), 0, *found, False, scale=scale
+        )
+        checkboxes, check, _, s7, little, s1 = found
+        return {
+            "checkboxes": [box[:4] for box in checkboxes],
+            "sections": [box[5] for box in checkboxes],
+            "check": check,
+            "cells": [box[:4] for box in s7],
+            "lines": [box[:4] for box in s1],
+            "line_sections": [box[6] for box in s1],
+            "little": len(little),
+        }
+
+    def test_half_scale_finds_the_same_structure(self):
+        """Is a half scale page's structure that of the full page?"""
+        page = np.full((2180, 1653), 255, dtype=np.uint8)
+        for n in range(8):
+            y = 300 + n * 100
+            cv2.rectangle(page, (60, y), (100, y + 40), 0, 3)
+            cv2.rectangle(page, (200, y + 50), (1500, y + 90), 0, 2)
+        for n in range(5):
+            x = 400 + n * 150
+            cv2.rectangle(page, (x, 150), (x + 30, 180), 0, 3)
+        for row in range(3):
+            for column in range(4):
+                x, y = 200 + column * 250, 1200 + row * 100
+                cv2.rectangle(page, (x, y), (x + 200, y + 60), 0, 3)
+        half = cv2.resize(
+            page, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA
+        )
+
+        full, reduced = self.structure(page, 1.0), self.structure(half, 0.5)
+        # Boxes this small only pass the size thresholds if they scale
+        self.assertEqual(reduced["little"], 5)
+        self.assertEqual(len(reduced["cells"]), 12)
+        for key in ("sections", "check", "line_sections", "little"):
+            self.assertEqual(full[key], reduced[key])
+        # Boxes are stored in full page coordinates, give or take the
+        # pixels lost to the reduction
+        for key in ("checkboxes", "cells", "lines"):
+            self.assertEqual(len(full[key]), len(reduced[key]))
+            np.testing.assert_allclose(full[key], reduced[key], atol=3)
+
+
+class GroupRowsTest(TestCase):
+    def test_rows_match_the_rolling_window_grouping(self):
+        """Are boxes grouped into rows as the pandas rolling window did?"""
+        boxes = [
+            (300, 100, 50, 20, 0),
+            (100, 104, 50, 20, 0),
+            (100, 300, 50, 20, 1),
+            (100, 108, 50, 20, 0),
+            (100, 118, 50, 20, 0),
+            (200, 140, 50, 20, 0),
+            (100, 140, 50, 20, 0),
+            (100, 295, 50, 20, 0),
+            (100, 905, 50, 20, 1),
+            (200, 300, 50, 20, 1, range(300, 320), "Gifts"),
+        ]
+        rows = group_rows(boxes)
+        # Boxes chain into a row while each is within 10 pixels of the one
+        # before it, and the page is only a sort key, so the last box of
+        # page 0 joins the first row of page 1.
+        self.assertEqual(
+            [[box["index"] for box in row] for row in rows],
+            [[0, 1, 3, 4], [5, 6], [7, 2, 9], [8]],
+        )
+        self.assertEqual([row[0]["group"] for row in rows], [0, 1, 2, 3])
+        self.assertEqual(rows[2][2]["section"], "Gifts")
+        self.assertNotIn("section", rows[2][0])
+        self.assertEqual(group_rows([]), [])
+
+
+class SectionIndexTest(TestCase):
+    def test_matches_linear_search(self):
+        """Does the index place text lines like the linear search?"""
+        rng = np.random.default_rng(0)
+        checkboxes, index = [], SectionIndex()
+        for n in range(40):
+            page, y = rng.integers(0, 3), rng.integers(0, 50) * 10
+            checkboxes.append((0, y, 20, 20, page, f"Section {n % 8}"))
+            index.update(checkboxes)
+            for page, y in rng.integers(0, 500, (20, 2)) % (4, 500):
+                rect = (0, y, 200, 10, page)
+                self.assertEqual(
+                    index.section_of(rect),
+                    determine_section_of_contour(checkboxes, rect),
+                )
+
+
+class FlakyPDFHandler(BaseHTTPRequestHandler):
+    """Serve a fake PDF, failing the first request for /flaky"""
+
+    body = b"%PDF-1.4 " + b"x" * 200000
+    failures = {}
+
+    def do_GET(self):
+        if self.path == "/flaky" and not self.failures.get(self.path):
+            self.failures[self.path] = True
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), FlakyPDFHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:%s" % cls.server.server_port
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_download_and_retry(self):
+        """Do downloads stream, retry server errors and respect the cap?"""
+        body = FlakyPDFHandler.body
+        self.assertEqual(download_pdf(self.url + "/pdf"), body)
+        self.assertEqual(download_pdf(self.url + "/flaky", backoff=0), body)
+        with self.assertRaises(PDFTooLarge):
+            download_pdf(self.url + "/pdf", max_size=1000)
+
+    def test_extract_many_prefetches_urls(self):
+        """Are a batch's URLs downloaded ahead, for the workers to extract?"""
+        items = [self.url + "/pdf", b"%PDF-1.4", self.url + "/flaky"]
+        with mock.patch.dict(EXTRACTORS, {"size": pdf_size}), mock.patch(
+            "disclosure_extractor.download_many", wraps=download_many
+        ) as downloads:
+            results = list(
+                extract_many(items, workers=2, ordered=True, extractor="size")
+            )
+        self.assertEqual(downloads.call_count, 1)
+        self.assertEqual([item for item, _ in results], items)
+        size = len(FlakyPDFHandler.body)
+        self.assertEqual(
+            [result["pdf_size"] for _, result in results], [size, 8, size]
+        )
+
+    def test_download_many(self):
+        """Are batches of downloads returned in order?"""
+        urls = [self.url + "/%s" % i for i in range(6)]
+        results = list(download_many(urls, workers=3))
+        self.assertEqual([url for url, _ in results], urls)
+        self.assertTrue(all(pdf == FlakyPDFHandler.body for _, pdf in results))
+
+
 if __name__ == "__main__":
     unittest.main()